@@ -1,3 +1,39 @@
-from .py_cos import COS
-from .py_sql import SQL
-from .py_nosql import NoSQL
\ No newline at end of file
+import importlib
+
+# public names and the submodule defining them, submodules are imported on
+# first access so importing the package does not pull in every backend
+_LAZY = {
+    "COS": "py_cos",
+    "SQL": "py_sql",
+    "NoSQL": "py_nosql",
+    "Query": "py_query",
+    "ResultCache": "py_cache",
+    "TableSync": "py_sync",
+    "AsyncSQL": "py_async",
+    "AsyncCOS": "py_async",
+    "AsyncNoSQL": "py_async",
+    "get_client": "py_registry",
+    "clear_clients": "py_registry",
+    "MissingCreds": "utils",
+    # the backends import py_metrics as a top level module while this resolves
+    # the package submodule, so it is loaded twice. py_metrics._shared_registry
+    # hands both copies the same MetricsRegistry, package.REGISTRY is therefore
+    # the registry every backend reports to
+    "REGISTRY": "py_metrics",
+    "SpanRecorder": "py_metrics",
+    "OpenTelemetrySink": "py_metrics",
+    "set_enabled": "py_metrics",
+}
+
+__all__ = list(_LAZY)
+
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module = importlib.import_module(f".{_LAZY[name]}", __name__)
+    value = getattr(module, name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
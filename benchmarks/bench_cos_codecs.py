@@ -0,0 +1,65 @@
+# Measures compression throughput and ratio of the COS object codecs
+#
+# Usage:
+#   python benchmarks/bench_cos_codecs.py [--rows 1000000] [--repeat 3]
+#
+# A synthetic csv is compressed and decompressed in memory through the same
+# streaming code paths COS uses on upload and read, the reported throughput is
+# the best of the repeats in MB/s of uncompressed data. Codecs whose library
+# is not installed are reported as unavailable.
+import io
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from py_cos import _CompressingReader, _decompress_stream
+
+CODECS = ["gzip", "zstd"]
+
+def make_csv(rows):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        "id": np.arange(rows),
+        "value": rng.normal(size=rows),
+        "category": rng.choice(["alpha", "beta", "gamma", "delta"], size=rows),
+        "ts": pd.date_range("2020-01-01", periods=rows, freq="s"),
+    })
+    return df.to_csv(index=False).encode()
+
+def best_of(repeat, func):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best[0]:
+            best = (elapsed, result)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    data = make_csv(args.rows)
+    mb = len(data) / 1024 / 1024
+    print(f"{'codec':<8}{'ratio':>8}{'compress MB/s':>16}{'decompress MB/s':>18}   ({mb:.1f} MB csv)")
+
+    for codec in CODECS:
+        try:
+            compress_s, compressed = best_of(args.repeat, lambda: _CompressingReader(io.BytesIO(data), codec).read())
+            decompress_s, restored = best_of(args.repeat, lambda: _decompress_stream(io.BytesIO(compressed), codec).read())
+        except ImportError:
+            print(f"{codec:<8}unavailable")
+            continue
+        assert restored == data
+        print(f"{codec:<8}{len(data) / len(compressed):>8.2f}{mb / compress_s:>16.1f}{mb / decompress_s:>18.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+# Measures import time of the package and of each backend
+#
+# Usage:
+#   python benchmarks/bench_import.py [--repeat 5] [--top 10]
+#
+# Every scenario runs in a fresh interpreter with -X importtime, the reported
+# time is the best cumulative import time over the repeats. Scenarios whose
+# dependencies are not installed are reported as unavailable.
+import os
+import sys
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE = os.path.basename(ROOT)
+
+SCENARIOS = {
+    "package": f"import {PACKAGE}",
+    "package.SQL": f"import {PACKAGE}; {PACKAGE}.SQL",
+    "package.COS": f"import {PACKAGE}; {PACKAGE}.COS",
+    "package.NoSQL": f"import {PACKAGE}; {PACKAGE}.NoSQL",
+    "py_sql": "import py_sql",
+    "py_cos": "import py_cos",
+    "py_nosql": "import py_nosql",
+}
+
+def import_times(statement):
+    """
+        Runs statement in a fresh interpreter and returns the cumulative import
+        time in microseconds and nesting depth of every module it imported
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.path.dirname(ROOT), ROOT]))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        # names of modules imported by other modules are indented
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        times[name.strip()] = (int(cumulative_us), depth)
+    return times
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    for scenario, statement in SCENARIOS.items():
+        best = None
+        for _ in range(args.repeat):
+            times = import_times(statement)
+            if times is None:
+                break
+            top_level = {name: us for name, (us, depth) in times.items() if depth == 0}
+            total = sum(top_level.values())
+            if best is None or total < best[0]:
+                best = (total, top_level)
+
+        if best is None:
+            print(f"{scenario:<16}unavailable")
+            continue
+
+        total, top_level = best
+        print(f"{scenario:<16}{total / 1000:>10.1f} ms")
+        for name, us in sorted(top_level.items(), key=lambda item: -item[1])[:args.top]:
+            print(f"    {name:<30}{us / 1000:>10.1f} ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+# Compares SQL.read against the COPY TO STDOUT fast path (SQL.read(fast=True))
+#
+# Usage:
+#   python benchmarks/bench_sql_read.py [--schema public] [--repeat 3]
+#
+# Credentials are taken from VCAP_SERVICES / vcap_services.json as for SQL().
+# Two scratch tables are created, filled and dropped again:
+#   bench_read_wide: 200 columns x 20k rows
+#   bench_read_long: 8 columns x 1M rows
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from py_sql import SQL
+
+def make_frame(rows, numeric_cols, text_cols):
+    rng = np.random.default_rng(0)
+    data = {"id": np.arange(rows)}
+    for i in range(numeric_cols):
+        data[f"n{i}"] = rng.random(rows)
+    for i in range(text_cols):
+        data[f"t{i}"] = rng.integers(0, 1000, rows).astype(str)
+    data["ts"] = pd.Timestamp("2020-01-01") + pd.to_timedelta(rng.integers(0, 10**8, rows), unit="s")
+    return pd.DataFrame(data)
+
+def create_table(sql, schema, name, df):
+    types = {"i": "BIGINT", "f": "DOUBLE PRECISION", "M": "TIMESTAMP"}
+    structure = [f"{col} {types.get(dtype.kind, 'TEXT')}" for col, dtype in df.dtypes.items()]
+    with sql._raw_connection() as connection:
+        cur = connection.cursor()
+        cur.execute(f"DROP TABLE IF EXISTS {schema}.{name}")
+        connection.commit()
+        cur.close()
+    sql.create(f"{schema}.{name}", structure + ["id"])
+    sql.update(df, name, schema, bulk=True)
+
+def drop_table(sql, schema, name):
+    with sql._raw_connection() as connection:
+        cur = connection.cursor()
+        cur.execute(f"DROP TABLE IF EXISTS {schema}.{name}")
+        connection.commit()
+        cur.close()
+
+def timed(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        df = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, df
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--schema", default="public")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    sql = SQL()
+    tables = {
+        "bench_read_wide": make_frame(20000, 150, 48),
+        "bench_read_long": make_frame(1000000, 4, 2),
+    }
+
+    print(f"{'table':<18}{'mode':<8}{'seconds':>10}{'rows/s':>14}{'df MB':>10}")
+    try:
+        for name, df in tables.items():
+            create_table(sql, args.schema, name, df)
+            for mode, fast in (("read", False), ("fast", True)):
+                seconds, result = timed(lambda: sql.read(name, args.schema, fast=fast), args.repeat)
+                size = result.memory_usage(deep=True).sum() / 1024 ** 2
+                print(f"{name:<18}{mode:<8}{seconds:>10.3f}{len(result) / seconds:>14,.0f}{size:>10.1f}")
+    finally:
+        for name in tables:
+            drop_table(sql, args.schema, name)
+        sql.close()
+
+if __name__ == '__main__':
+    main()
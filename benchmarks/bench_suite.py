@@ -0,0 +1,323 @@
+# Benchmark suite of SQL, COS and NoSQL against local stand-ins
+#
+# Usage:
+#   python benchmarks/bench_suite.py [--sizes 10000,100000] [--repeat 5]
+#                                    [--only sql.read,cos.get_item] [--output results.json]
+#   python benchmarks/compare_results.py baseline.json results.json
+#
+# No network is needed, see local_services.py for the stand-ins. Every
+# scenario and size runs in its own process so peak RSS is attributable to
+# it: the data is set up, the operation runs once as warmup and then repeat
+# times. Reported per run:
+#   latency_s:      p50 / p95 / p99 / mean of the timed repeats
+#   rows_per_s:     rows moved per second at the median latency
+#   mb_per_s:       payload MB moved per second at the median latency
+#   peak_rss_mb:    peak resident memory of the scenario process
+#   setup_rss_mb:   resident memory once the data was set up
+# Scenarios whose stand-in is missing, or that the stand-in cannot run, are
+# reported as unavailable.
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import numpy as np
+import pandas as pd
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+
+SCHEMA = "public"
+BUCKET = "ro-bench"
+
+def make_frame(rows):
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        "id": np.arange(rows),
+        "qty": rng.integers(0, 1000, rows),
+        "price": rng.random(rows),
+        "label": rng.integers(0, 1000, rows).astype(str),
+        "ts": pd.Timestamp("2020-01-01") + pd.to_timedelta(rng.integers(0, 10**8, rows), unit="s"),
+    })
+
+def frame_bytes(df):
+    return int(df.memory_usage(deep=True, index=False).sum())
+
+def rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except OSError:
+        return None
+
+def peak_rss_mb():
+    # VmHWM starts over on exec, ru_maxrss keeps the peak of the forking parent
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+# Scenarios
+#
+# A scenario takes the data size and returns (operation, rows, nbytes), the
+# operation is timed, rows and nbytes are the amount of data one call moves.
+
+def sql_table(sql, size):
+    df = make_frame(size)
+    name = f"bench_{size}"
+    with sql._raw_connection() as connection:
+        cur = connection.cursor()
+        cur.execute(f"DROP TABLE IF EXISTS {SCHEMA}.{name}")
+        connection.commit()
+        cur.close()
+    sql.create(f"{SCHEMA}.{name}", ["id BIGINT", "qty BIGINT", "price DOUBLE PRECISION", "label TEXT", "ts TIMESTAMP", "id"])
+    sql.update(df, name, SCHEMA, pmkey="id", bulk=True)
+    return df, name
+
+def sql_read(size, fast=False):
+    from py_sql import SQL
+
+    sql = SQL()
+    df, name = sql_table(sql, size)
+    return lambda: sql.read(name, SCHEMA, fast=fast), size, frame_bytes(df)
+
+def sql_read_fast(size):
+    return sql_read(size, fast=True)
+
+def sql_update(size, bulk=False):
+    from py_sql import SQL
+
+    sql = SQL()
+    df, name = sql_table(sql, size)
+    # every row hits an existing key, the timed call is a pure upsert
+    return lambda: sql.update(df, name, SCHEMA, pmkey="id", bulk=bulk), size, frame_bytes(df)
+
+def sql_update_bulk(size):
+    return sql_update(size, bulk=True)
+
+def cos_client():
+    from py_cos import COS
+
+    cos = COS()
+    try:
+        cos._cos_cli.create_bucket(Bucket=BUCKET)
+    except Exception:
+        pass
+    return cos
+
+def cos_get_item(size):
+    cos = cos_client()
+    df = make_frame(size)
+    body = df.to_csv(index=False).encode()
+    cos._cos_cli.put_object(Bucket=BUCKET, Key=f"get_{size}.csv", Body=body)
+    return lambda: cos.get_item(BUCKET, f"get_{size}.csv"), size, len(body)
+
+def cos_upload_dataframe(size):
+    cos = cos_client()
+    df = make_frame(size)
+    nbytes = len(df.to_csv(index=False).encode())
+    return lambda: cos.upload_dataframe(df, BUCKET, f"upload_{size}.csv"), size, nbytes
+
+def cos_list(size):
+    # one listed key per 100 rows of the data size, at least 100 keys
+    cos = cos_client()
+    keys = max(100, size // 100)
+    prefix = f"list_{size}/"
+    if len(cos.get_bucket_contents(BUCKET, prefix)) != keys:
+        failures = [result for result in cos.upload_many(BUCKET, [(f"{prefix}{i:08d}", b"x") for i in range(keys)]) if result.error]
+        if failures:
+            raise RuntimeError(f"{len(failures)} of {keys} keys failed to upload: {failures[0].error}")
+
+    def run():
+        listed = len(cos.get_bucket_contents(BUCKET, prefix))
+        if listed != keys:
+            raise RuntimeError(f"listed {listed} keys under {prefix}, expected {keys}")
+
+    run()
+    return run, keys, 0
+
+def nosql_client():
+    import py_nosql
+
+    if os.getenv("BENCH_MONGOMOCK"):
+        import mongomock
+        py_nosql.MongoClient = mongomock.MongoClient
+    return py_nosql.NoSQL(tls=False)
+
+def nosql_documents(size):
+    df = make_frame(size)
+    df["ts"] = df["ts"].dt.to_pydatetime()
+    return df.to_dict("records"), frame_bytes(df)
+
+def nosql_update_collection(size):
+    # one round trip per document, capped so large sizes finish
+    nosql = nosql_client()
+    documents, nbytes = nosql_documents(min(size, 10000))
+    collection = f"single_{size}"
+
+    def run():
+        nosql.get_database().drop_collection(collection)
+        nosql._collections.clear()
+        for document in documents:
+            nosql.update_collection(collection, dict(document))
+
+    return run, len(documents), nbytes
+
+def nosql_bulk_writer(size):
+    nosql = nosql_client()
+    documents, nbytes = nosql_documents(size)
+    collection = f"bulk_{size}"
+
+    def run():
+        nosql.get_database().drop_collection(collection)
+        with nosql.bulk_writer() as writer:
+            for document in documents:
+                writer.insert(collection, dict(document))
+
+    return run, size, nbytes
+
+def nosql_read(size):
+    nosql = nosql_client()
+    documents, nbytes = nosql_documents(size)
+    collection = f"read_{size}"
+    nosql.get_database().drop_collection(collection)
+    with nosql.bulk_writer() as writer:
+        for document in documents:
+            writer.insert(collection, document)
+    return lambda: sum(len(chunk) for chunk in nosql.read(collection)), size, nbytes
+
+# scenarios the mongomock stand-in cannot run, NoSQL.read needs the raw
+# batches of a real server
+MONGOMOCK_UNSUPPORTED = {"nosql.read"}
+
+SCENARIOS = {
+    "sql.read": ("sql", sql_read),
+    "sql.read_fast": ("sql", sql_read_fast),
+    "sql.update": ("sql", sql_update),
+    "sql.update_bulk": ("sql", sql_update_bulk),
+    "cos.get_item": ("cos", cos_get_item),
+    "cos.upload_dataframe": ("cos", cos_upload_dataframe),
+    "cos.list": ("cos", cos_list),
+    "nosql.update_collection": ("nosql", nosql_update_collection),
+    "nosql.bulk_writer": ("nosql", nosql_bulk_writer),
+    "nosql.read": ("nosql", nosql_read),
+}
+
+def percentile(values, q):
+    return float(np.percentile(values, q))
+
+def run_worker(scenario, size, repeat):
+    """
+        Runs one scenario in the current process and prints its result as json
+    """
+    import logging
+    logging.disable(logging.INFO)
+
+    operation, rows, nbytes = SCENARIOS[scenario][1](size)
+    setup_rss = rss_mb()
+    operation()
+
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        operation()
+        latencies.append(time.perf_counter() - start)
+
+    p50 = percentile(latencies, 50)
+    print(json.dumps({
+        "latency_s": {
+            "p50": p50,
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "mean": float(np.mean(latencies)),
+        },
+        "rows": rows,
+        "bytes": nbytes,
+        "rows_per_s": rows / p50 if p50 else None,
+        "mb_per_s": nbytes / 1024 / 1024 / p50 if p50 and nbytes else None,
+        "setup_rss_mb": setup_rss,
+        "peak_rss_mb": peak_rss_mb(),
+    }))
+
+def git_revision():
+    result = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True)
+    return result.stdout.strip() if result.returncode == 0 else None
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="10000,100000")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", default=None, help="comma separated scenario names")
+    parser.add_argument("--output", default=os.path.join(BENCH_DIR, "results.json"))
+    parser.add_argument("--worker", nargs=2, metavar=("SCENARIO", "SIZE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker[0], int(args.worker[1]), args.repeat)
+        return
+
+    from local_services import local_services
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    scenarios = args.only.split(",") if args.only else list(SCENARIOS)
+    results = []
+
+    with local_services() as (env, available):
+        for service, description in available.items():
+            print(f"{service:<8}{description or 'unavailable'}")
+
+        env = dict(os.environ, **env)
+        for scenario in scenarios:
+            service = SCENARIOS[scenario][0]
+            for size in sizes:
+                result = {"scenario": scenario, "size": size}
+                if not available[service]:
+                    result["status"] = "unavailable"
+                elif available[service] == "mongomock" and scenario in MONGOMOCK_UNSUPPORTED:
+                    result.update(status="unavailable", error="not supported by mongomock")
+                else:
+                    process = subprocess.run(
+                        [sys.executable, os.path.abspath(__file__), "--worker", scenario, str(size), "--repeat", str(args.repeat)],
+                        env=env, capture_output=True, text=True)
+                    if process.returncode == 0:
+                        result.update(json.loads(process.stdout.strip().splitlines()[-1]), status="ok")
+                    else:
+                        result.update(status="failed", error=process.stderr.strip().splitlines()[-1] if process.stderr.strip() else "")
+                results.append(result)
+                print(format_result(result))
+
+    with open(args.output, "w") as f:
+        json.dump({
+            "meta": {
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "revision": git_revision(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "repeat": args.repeat,
+                "services": available,
+            },
+            "results": results,
+        }, f, indent=2)
+    print(f"results written to {args.output}")
+
+def format_result(result):
+    name = f"{result['scenario']} [{result['size']}]"
+    if result["status"] != "ok":
+        return f"{name:<36}{result['status']} {result.get('error', '')}"
+    latency = result["latency_s"]
+    rate = f"{result['rows_per_s']:>12,.0f} rows/s" if result["rows_per_s"] else ""
+    return (f"{name:<36}p50 {latency['p50'] * 1000:>9.1f} ms  p95 {latency['p95'] * 1000:>9.1f} ms  "
+            f"p99 {latency['p99'] * 1000:>9.1f} ms  {rate}  peak {result['peak_rss_mb']:>7.1f} MB")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+# Compares two result files written by bench_suite.py
+#
+# Usage:
+#   python benchmarks/compare_results.py baseline.json results.json [--threshold 0.1]
+#
+# For every scenario and size present in both files the median latency, the
+# row throughput and the peak RSS are shown side by side. A run is flagged as
+# a regression when its median latency or peak RSS grew by more than the
+# threshold, the exit status is 1 when any run regressed.
+import sys
+import json
+import argparse
+
+def load(path):
+    with open(path) as f:
+        data = json.load(f)
+    return data["meta"], {(r["scenario"], r["size"]): r for r in data["results"]}
+
+def change(before, after):
+    if not before or after is None:
+        return None
+    return after / before - 1
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args()
+
+    baseline_meta, baseline = load(args.baseline)
+    current_meta, current = load(args.current)
+    print(f"baseline  {baseline_meta.get('revision')}  {baseline_meta.get('timestamp')}")
+    print(f"current   {current_meta.get('revision')}  {current_meta.get('timestamp')}")
+    print()
+    print(f"{'scenario':<36}{'p50 ms':>20}{'change':>9}{'rows/s':>26}{'peak MB':>18}{'change':>9}")
+
+    regressions = 0
+    for key in sorted(set(baseline) | set(current)):
+        name = f"{key[0]} [{key[1]}]"
+        before, after = baseline.get(key), current.get(key)
+        if not before or not after or before["status"] != "ok" or after["status"] != "ok":
+            status = (before or {}).get("status", "missing"), (after or {}).get("status", "missing")
+            print(f"{name:<36}{status[0]} -> {status[1]}")
+            continue
+
+        latency = change(before["latency_s"]["p50"], after["latency_s"]["p50"])
+        rss = change(before["peak_rss_mb"], after["peak_rss_mb"])
+        regressed = (latency or 0) > args.threshold or (rss or 0) > args.threshold
+        regressions += regressed
+
+        print(f"{name:<36}"
+              f"{before['latency_s']['p50'] * 1000:>9.1f} {after['latency_s']['p50'] * 1000:>9.1f}{latency:>+9.1%}"
+              f"{before['rows_per_s'] or 0:>13,.0f}{after['rows_per_s'] or 0:>13,.0f}"
+              f"{before['peak_rss_mb']:>9.1f}{after['peak_rss_mb']:>9.1f}{rss:>+9.1%}"
+              f"{'  REGRESSION' if regressed else ''}")
+
+    sys.exit(1 if regressions else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+# Local stand-ins for the services used by the benchmarks
+#
+#   postgres: temporary cluster created with initdb and started with pg_ctl,
+#             binaries are looked up on PATH or in PG_BIN
+#   s3:       minio binary when on PATH, otherwise an in-process moto server
+#   mongodb:  mongod binary when on PATH, otherwise mongomock inside the
+#             benchmark process (BENCH_MONGOMOCK=1)
+#
+# Every stand-in listens on 127.0.0.1 only and its data lives in a temporary
+# directory removed on exit. local_services() yields the environment (a
+# VCAP_SERVICES document plus COS_ENDPOINT) pointing SQL, COS and NoSQL at them.
+import os
+import json
+import time
+import logging
+import shutil
+import socket
+import tempfile
+import subprocess
+import urllib.request
+
+from contextlib import contextmanager, ExitStack
+
+S3_ACCESS_KEY = "benchmark"
+S3_SECRET_KEY = "benchmark-secret"
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def wait_for(check, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if check():
+                return
+        except OSError:
+            pass
+        time.sleep(0.1)
+    raise TimeoutError("service did not start in time")
+
+def find_binary(name, env_dir=None):
+    if env_dir and os.getenv(env_dir):
+        path = os.path.join(os.getenv(env_dir), name)
+        if os.path.isfile(path):
+            return path
+    return shutil.which(name)
+
+@contextmanager
+def postgres(root):
+    """
+        Starts a throwaway postgres cluster, yields its connection settings or
+        None when initdb / pg_ctl are not installed
+    """
+    initdb, pg_ctl = find_binary("initdb", "PG_BIN"), find_binary("pg_ctl", "PG_BIN")
+    if not initdb or not pg_ctl:
+        yield None
+        return
+
+    data = os.path.join(root, "pgdata")
+    port = free_port()
+    subprocess.run([initdb, "-D", data, "-U", "bench", "-A", "trust", "--no-sync"], check=True, capture_output=True)
+    options = f"-p {port} -k {root} -c listen_addresses=127.0.0.1 -c fsync=off -c synchronous_commit=off -c full_page_writes=off"
+    subprocess.run([pg_ctl, "-D", data, "-o", options, "-l", os.path.join(root, "postgres.log"), "-w", "start"], check=True, capture_output=True)
+    try:
+        yield {"host": "127.0.0.1", "port": port, "user": "bench", "database": "postgres"}
+    finally:
+        subprocess.run([pg_ctl, "-D", data, "-m", "fast", "-w", "stop"], capture_output=True)
+
+@contextmanager
+def s3(root):
+    """
+        Starts an S3 compatible server, yields its endpoint url or None when
+        neither minio nor moto is installed
+    """
+    minio = find_binary("minio")
+    port = free_port()
+    endpoint = f"http://127.0.0.1:{port}"
+
+    if minio:
+        env = dict(os.environ, MINIO_ROOT_USER=S3_ACCESS_KEY, MINIO_ROOT_PASSWORD=S3_SECRET_KEY)
+        process = subprocess.Popen(
+            [minio, "server", os.path.join(root, "minio"), "--address", f"127.0.0.1:{port}"],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_for(lambda: urllib.request.urlopen(f"{endpoint}/minio/health/live").status == 200)
+            yield endpoint
+        finally:
+            process.terminate()
+            process.wait()
+        return
+
+    try:
+        from moto.server import ThreadedMotoServer
+    except ImportError:
+        yield None
+        return
+
+    # the moto server logs every request through werkzeug
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port, verbose=False)
+    server.start()
+    try:
+        yield endpoint
+    finally:
+        server.stop()
+
+@contextmanager
+def mongodb(root):
+    """
+        Starts a mongod server, yields its connection string, "mongomock" when
+        mongod is not installed but mongomock is, None otherwise
+    """
+    mongod = find_binary("mongod")
+    if not mongod:
+        try:
+            import mongomock
+        except ImportError:
+            yield None
+        else:
+            yield "mongomock"
+        return
+
+    data = os.path.join(root, "mongodb")
+    os.makedirs(data)
+    port = free_port()
+    process = subprocess.Popen(
+        [mongod, "--dbpath", data, "--port", str(port), "--bind_ip", "127.0.0.1"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for(lambda: socket.create_connection(("127.0.0.1", port), timeout=1).close() is None)
+        yield f"mongodb://127.0.0.1:{port}/bench"
+    finally:
+        process.terminate()
+        process.wait()
+
+@contextmanager
+def local_services():
+    """
+        Starts every available stand-in
+
+        Response:
+            env:        <dict>
+                        environment variables for benchmark processes
+            available:  <dict>
+                        sql, cos, nosql -> description of the stand-in, None
+                        when it could not be started
+    """
+    with ExitStack() as stack:
+        root = stack.enter_context(tempfile.TemporaryDirectory(prefix="ro-bench-"))
+        pg = stack.enter_context(postgres(root))
+        endpoint = stack.enter_context(s3(root))
+        mongo = stack.enter_context(mongodb(root))
+
+        vcap = {}
+        env = {}
+        if pg:
+            composed = f"postgresql://{pg['user']}@{pg['host']}:{pg['port']}/{pg['database']}"
+            vcap["databases-for-postgresql"] = [{"credentials": {"connection": {"postgres": {
+                "hosts": [{"hostname": pg["host"], "port": pg["port"]}],
+                "authentication": {"username": pg["user"], "password": ""},
+                "database": pg["database"],
+                "composed": [composed]}}}}]
+        if endpoint:
+            vcap["cloud-object-storage"] = [{"credentials": {
+                "cos_hmac_keys": {"access_key_id": S3_ACCESS_KEY, "secret_access_key": S3_SECRET_KEY}}}]
+            env["COS_ENDPOINT"] = endpoint
+        if mongo == "mongomock":
+            env["BENCH_MONGOMOCK"] = "1"
+            mongo_composed = "mongodb://127.0.0.1:27017/bench"
+        else:
+            mongo_composed = mongo
+        if mongo:
+            vcap["databases-for-mongodb"] = [{"credentials": {"connection": {"mongodb": {"composed": [mongo_composed]}}}}]
+
+        env["VCAP_SERVICES"] = json.dumps(vcap)
+        available = {
+            "sql": f"postgres :{pg['port']}" if pg else None,
+            "cos": endpoint and ("minio " if find_binary("minio") else "moto ") + endpoint,
+            "nosql": mongo,
+        }
+        yield env, available
@@ -0,0 +1,309 @@
+# Asyncio counterparts of SQL, COS and NoSQL
+import os
+import ssl
+import asyncio
+import functools
+import pandas as pd
+
+from utils import *
+from pymongo.errors import CollectionInvalid
+from py_query import Query
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+
+class AsyncSQL():
+
+    def __init__(self, pool_min_size: int=1, pool_max_size: int=10, max_concurrency: int=None):
+        """
+            Initializes AsyncSQL class, an asyncpg backed counterpart of SQL.
+
+            The connection pool is opened on first use or with open(), the class
+            can also be used as an async context manager. asyncpg caches prepared
+            statements per connection, so repeated query shapes skip parse and plan.
+
+            Parameters:
+                pool_min_size:    <int>
+                                  connections opened up front
+                pool_max_size:    <int>
+                                  upper bound of pooled connections
+                max_concurrency:  <int>
+                                  operations in flight at the same time, defaults
+                                  to pool_max_size
+        """
+        creds = get_service_credentials('databases-for-postgresql')["connection"]["postgres"]
+        self._dsn = creds["composed"][0]
+        self._pool_min_size = pool_min_size
+        self._pool_max_size = pool_max_size
+        self._semaphore = asyncio.Semaphore(max_concurrency or pool_max_size)
+        self._pool = None
+        self._pool_lock = asyncio.Lock()
+
+        cafile = os.getenv('POSTGRESQL_ROOT_CRT')
+        self._ssl = ssl.create_default_context(cafile=cafile) if cafile else None
+
+    async def open(self):
+        """
+            Opens the connection pool
+        """
+        import asyncpg
+
+        async with self._pool_lock:
+            if self._pool is None:
+                self._pool = await asyncpg.create_pool(
+                    dsn=self._dsn,
+                    min_size=self._pool_min_size,
+                    max_size=self._pool_max_size,
+                    ssl=self._ssl)
+        return self
+
+    async def close(self):
+        """
+            Closes the connection pool
+        """
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def _acquire(self):
+        if self._pool is None:
+            await self.open()
+        return self._pool.acquire()
+
+    async def create(self, table_name: str, table_structure: list):
+        """
+            Creates new SQL table, see SQL.create
+        """
+        primary_key = table_structure[-1]
+        table = ", ".join(table_structure[:-1])
+        cmd = f"CREATE TABLE {table_name} ({table}, PRIMARY KEY ({primary_key}));"
+        async with self._semaphore:
+            async with await self._acquire() as connection:
+                await connection.execute(cmd)
+
+    async def read(self, table_name: str, schema: str, columns: list=None, conditionals: list=None, conditional_type: str=None, date_col: str=None, start_date: str=None, end_date: str=None, order_by: list=None, limit: int=None):
+        """
+            Retrieve the sql datatable to pandas dataframe, see SQL.read
+
+            asyncpg does not coerce text parameters, start_date and end_date are
+            converted to datetime and conditional values must match column types.
+        """
+        query = Query(table_name, schema, columns)
+        if conditionals:
+            query.where(*conditionals, conjunction=conditional_type or "AND")
+        if date_col and start_date and end_date:
+            query.where((date_col, "between", (pd.Timestamp(start_date).to_pydatetime(), pd.Timestamp(end_date).to_pydatetime())))
+        if order_by:
+            query.order_by(*order_by)
+        if limit is not None:
+            query.limit(limit)
+        return await self.read_query(query)
+
+    async def read_query(self, query: Query):
+        """
+            Retrieves the rows selected by a Query to pandas dataframe
+        """
+        sql, params = query.compile(style="numeric")
+        async with self._semaphore:
+            async with await self._acquire() as connection:
+                statement = await connection.prepare(sql)
+                rows = await statement.fetch(*params)
+                columns = [attribute.name for attribute in statement.get_attributes()]
+        return pd.DataFrame.from_records([tuple(row) for row in rows], columns=columns, coerce_float=True)
+
+    async def update(self, df, df_name: str, schema: str, pmkey: str = None):
+        """
+            Inserts dataframe rows into target table, updating rows whose primary
+            key already exists when pmkey is given, see SQL.update
+
+            Rows are sent with the binary COPY protocol into a staging table and
+            merged with a single INSERT, duplicate keys resolve to the last row.
+            Values are stored as SQL.update stores them, see _records.
+        """
+        column_names = ",".join(df.columns)
+        target = f"{schema}.{df_name}"
+        staging = f"_stage_{df_name}"
+
+        merge_command = f"INSERT INTO {target} ({column_names}) SELECT {column_names} FROM "
+        if pmkey:
+            merge_command += f"(SELECT DISTINCT ON ({pmkey}) * FROM {staging} ORDER BY {pmkey}, _stage_row DESC) AS staged"
+            merge_command += f" ON CONFLICT ({pmkey}) DO UPDATE SET " + ", ".join([f"{x}=excluded.{x}" for x in df.columns.tolist()])
+        else:
+            merge_command += f"{staging} ORDER BY _stage_row"
+
+        records = self._records(df)
+        async with self._semaphore:
+            async with await self._acquire() as connection:
+                async with connection.transaction():
+                    await connection.execute(f"CREATE TEMP TABLE {staging} (LIKE {target} INCLUDING DEFAULTS) ON COMMIT DROP")
+                    await connection.execute(f"ALTER TABLE {staging} ADD COLUMN _stage_row BIGSERIAL")
+                    await connection.copy_records_to_table(staging, records=records, columns=list(df.columns))
+                    await connection.execute(merge_command)
+
+    @staticmethod
+    def _records(df):
+        """
+            Rows of df as python values for asyncpg: NaN, NaT and pd.NA become
+            None so they are stored as NULL, and float columns holding only whole
+            numbers, e.g. integer columns with missing values, are sent as ints
+        """
+        integral = [col for col, dtype in df.dtypes.items() if dtype.kind == "f" and (df[col].dropna() % 1 == 0).all()]
+        df = df.astype({col: "Int64" for col in integral}).astype(object)
+        df = df.where(df.notna(), None)
+        return list(df.itertuples(index=False, name=None))
+
+class AsyncCOS():
+
+    def __init__(self, cos=None, max_concurrency: int=32):
+        """
+            Initializes AsyncCOS class, an asyncio counterpart of COS.
+
+            ibm_boto3 has no asyncio transport, so every public COS method is
+            exposed as a coroutine running on a bounded thread pool that shares
+            the wrapped COS clients, e.g. await AsyncCOS().get_item(bucket, key).
+
+            Methods returning a lazy iterator, e.g. iter_bucket_contents,
+            get_item with chunksize or get_items with ordered=False, resolve to an
+            async iterator whose items are pulled on the thread pool too:
+                async for chunk in await cos.get_item(bucket, key, chunksize=1000)
+
+            Parameters:
+                cos:              <COS>
+                                  COS instance to wrap, a new one when None
+                max_concurrency:  <int>
+                                  transfers in flight at the same time
+        """
+        if cos is None:
+            from py_cos import COS
+            cos = COS()
+        self._cos = cos
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        method = getattr(self._cos, name)
+        if not callable(method):
+            raise AttributeError(name)
+
+        @functools.wraps(method)
+        async def call(*args, **kwargs):
+            result = await self._run(functools.partial(method, *args, **kwargs))
+            if isinstance(result, Iterator):
+                return self._iterate(result)
+            return result
+
+        return call
+
+    async def _run(self, func):
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, func)
+
+    async def _iterate(self, iterator):
+        """
+            Async iterator over a lazy COS result, every next() does blocking
+            I/O and runs on the thread pool instead of the event loop
+        """
+        # StopIteration cannot cross a future, the end is signalled by a sentinel
+        done = object()
+        try:
+            while True:
+                item = await self._run(functools.partial(next, iterator, done))
+                if item is done:
+                    return
+                yield item
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                await self._run(close)
+
+    async def close(self):
+        """
+            Shuts the thread pool down
+        """
+        self._executor.shutdown(wait=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+class AsyncNoSQL():
+
+    def __init__(self, db_name: str=None, max_concurrency: int=100):
+        """
+            Initializes AsyncNoSQL class, a motor backed counterpart of NoSQL
+
+            Parameters:
+                db_name:          <str>
+                                  database used when a method gets no db_name,
+                                  defaults to the database of the connection string
+                max_concurrency:  <int>
+                                  operations in flight at the same time
+        """
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        creds = get_service_credentials('databases-for-mongodb')
+        mongo_composed = creds["connection"]["mongodb"]["composed"][0]
+
+        self._mongo_cli = AsyncIOMotorClient(
+            mongo_composed,
+            tls = True,
+            tlsCAFile = "./tmpCert.crt")
+        self._db_name = db_name
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._collections = set()
+
+    def get_database(self, db_name: str=None):
+        """
+            Retrieves motor database object for specified database name
+        """
+        if db_name or self._db_name:
+            return self._mongo_cli.get_database(db_name or self._db_name)
+        return self._mongo_cli.get_default_database()
+
+    async def update_collection(self, col_name, document, db_name: str=None):
+        """
+            Inserts document in target collection, creating the collection first
+            if it does not exist yet, see NoSQL.update_collection
+        """
+        db = self.get_database(db_name)
+        async with self._semaphore:
+            if (db.name, col_name) not in self._collections:
+                if col_name not in await db.list_collection_names():
+                    try:
+                        await db.create_collection(col_name)
+                    except CollectionInvalid:
+                        # created concurrently by another writer
+                        pass
+                self._collections.add((db.name, col_name))
+            await db.get_collection(col_name).insert_one(document)
+
+    async def get_sequence(self, name: str="unique_ids", db_name: str=None):
+        """
+            Increments and retrieves the value of a named sequence
+        """
+        db = self.get_database(db_name)
+        async with self._semaphore:
+            document = await db.sequences.find_one_and_update({"_id": name}, {"$inc": {"value": 1}}, upsert=True, return_document=True)
+        return document["value"]
+
+    async def close(self):
+        """
+            Closes the motor client
+        """
+        self._mongo_cli.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
@@ -0,0 +1,390 @@
+# In-process result cache library imports
+import io
+import os
+import json
+import mmap
+import logging
+import time
+import shutil
+import hashlib
+import threading
+import pandas as pd
+
+from contextlib import contextmanager
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+class ResultCache():
+
+    def __init__(self, max_bytes: int=1024 * 1024 * 256, ttl: float=300, disk_dir: str=None):
+        """
+            Initializes a memory bounded LRU cache of dataframes with time to live
+
+            Entries are tagged with the table they were read from so a write to a
+            table drops every cached result of that table. Every invalidation also
+            bumps a per table generation, a result read before a write and stored
+            after it is dropped instead of being served until it expires.
+
+            Parameters:
+                max_bytes:  <int>
+                            memory budget, least recently used entries are evicted
+                            once cached dataframes use more than this
+                ttl:        <float>
+                            seconds an entry stays valid
+                disk_dir:   <str>
+                            optional directory of a parquet tier that keeps entries
+                            across restarts, entries evicted from memory stay there
+                            until they expire or their table is invalidated
+        """
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self._disk_dir = disk_dir
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "disk_hits": 0, "invalidations": 0}
+
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(*parts):
+        """
+            Builds a cache key from the normalized query text and its parameters
+        """
+        return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+    def get(self, key: str, table: str):
+        """
+            Retrieves a cached dataframe
+
+            Parameters:
+                key:    <str>
+                        key built with ResultCache.make_key
+                table:  <str>
+                        schema qualified table the result was read from
+            Response:
+                df:     copy of the cached dataframe, None on a miss
+        """
+        table = table.lower()
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, size, _, df = entry
+                if expires > now:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return df.copy()
+                self._drop(key)
+
+        df = self._disk_get(key, table, now)
+        with self._lock:
+            if df is None:
+                self._stats["misses"] += 1
+                return None
+            self._stats["hits"] += 1
+            self._stats["disk_hits"] += 1
+        self._memory_put(key, table, df)
+        return df.copy()
+
+    def generation(self, table: str):
+        """
+            Retrieves the generation of a table, taken before a read and passed
+            to put with its result
+        """
+        with self._lock:
+            return self._generations.get(table.lower(), 0)
+
+    def put(self, key: str, table: str, df, generation: int=None):
+        """
+            Stores a dataframe read from table under key
+
+            Parameters:
+                generation:  <int>
+                             generation of the table taken before the read, the
+                             result is not stored when the table was invalidated
+                             since
+        """
+        table = table.lower()
+        df = df.copy()
+        if not self._memory_put(key, table, df, generation):
+            return
+        if self._disk_dir:
+            self._disk_put(key, table, df, generation)
+
+    def invalidate(self, table: str):
+        """
+            Drops every cached result read from table
+        """
+        table = table.lower()
+        with self._lock:
+            self._generations[table] = self._generations.get(table, 0) + 1
+            for key in [key for key, entry in self._entries.items() if entry[2] == table]:
+                self._drop(key)
+            self._stats["invalidations"] += 1
+
+        if self._disk_dir:
+            shutil.rmtree(os.path.join(self._disk_dir, table), ignore_errors=True)
+
+    def clear(self):
+        """
+            Drops every cached result
+        """
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+        if self._disk_dir:
+            shutil.rmtree(self._disk_dir, ignore_errors=True)
+            os.makedirs(self._disk_dir, exist_ok=True)
+
+    def stats(self):
+        """
+            Retrieves cache counters
+
+            Response:
+                stats:  <dict>
+                        hits, misses, evictions, disk_hits, invalidations,
+                        entries and bytes held in memory
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._bytes
+        return stats
+
+    def _stale(self, table, generation):
+        return generation is not None and self._generations.get(table, 0) != generation
+
+    def _memory_put(self, key, table, df, generation=None):
+        """
+            Stores an entry in memory, False when its table was invalidated since
+            generation and the entry was dropped
+        """
+        size = int(df.memory_usage(deep=True).sum())
+
+        with self._lock:
+            if self._stale(table, generation):
+                return False
+            if size > self._max_bytes:
+                return True
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.time() + self._ttl, size, table, df)
+            self._bytes += size
+            while self._bytes > self._max_bytes:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self._stats["evictions"] += 1
+        return True
+
+    def _drop(self, key):
+        _, size, _, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def _disk_path(self, key, table):
+        return os.path.join(self._disk_dir, table, f"{key}.parquet")
+
+    def _disk_get(self, key, table, now):
+        if not self._disk_dir:
+            return None
+
+        path = self._disk_path(key, table)
+        try:
+            if os.path.getmtime(path) + self._ttl <= now:
+                os.remove(path)
+                return None
+            return pd.read_parquet(path)
+        except (OSError, ValueError):
+            return None
+
+    def _disk_put(self, key, table, df, generation=None):
+        path = self._disk_path(key, table)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            df.to_parquet(tmp_path)
+            os.replace(tmp_path, path)
+            # an invalidation that removed the table directory before the file
+            # landed bumped the generation, the stale file is removed here
+            with self._lock:
+                stale = self._stale(table, generation)
+            if stale:
+                os.remove(path)
+        except Exception as e:
+            logger.warning("Unable to write cache entry to disk: %s", e)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+class ObjectCache():
+
+    def __init__(self, cache_dir: str, max_bytes: int=1024 * 1024 * 1024):
+        """
+            Initializes a local disk cache of COS objects, shared by every process
+            on the host that points at the same cache_dir.
+
+            Cached objects are revalidated with a conditional GET on their ETag, so
+            a warm read costs one round trip without body. Objects are served as
+            read only memory maps and evicted least recently used first once the
+            cache holds more than max_bytes.
+
+            Parameters:
+                cache_dir:  <str>
+                            directory holding the cached objects
+                max_bytes:  <int>
+                            disk budget of the cache
+        """
+        self._cache_dir = cache_dir
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "bytes_downloaded": 0}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get(self, cos_cli, bucket_name: str, item_name: str):
+        """
+            Retrieves an object through the cache
+
+            Parameters:
+                cos_cli:      ibm_boto3 COS client used on a miss
+                bucket_name:  <str>
+                              name of target bucket
+                item_name:    <str>
+                              name of target file in bucket
+            Response:
+                file:         read only memory map of the object contents
+        """
+        path = self._path(bucket_name, item_name)
+
+        with self._file_lock(exclusive=False):
+            meta = self._read_meta(path)
+            cached = self._open(path) if meta else None
+
+        request = {"Bucket": bucket_name, "Key": item_name}
+        if cached is not None:
+            request["IfNoneMatch"] = meta["etag"]
+
+        try:
+            file = cos_cli.get_object(**request)
+        except Exception as e:
+            # ClientError of ibm_botocore, the response tells a 304 Not Modified apart
+            response = getattr(e, "response", None) or {}
+            status = response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+            if cached is not None and (status == 304 or response.get("Error", {}).get("Code") in ("304", "NotModified")):
+                os.utime(path)
+                with self._lock:
+                    self._stats["hits"] += 1
+                return cached
+            if cached is not None:
+                cached.close()
+            raise
+
+        if cached is not None:
+            cached.close()
+
+        # the body is streamed into a private temporary file first, only the
+        # rename into place happens under the cache lock
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        size = 0
+        with open(tmp_path, "wb") as f:
+            for chunk in iter(lambda: file["Body"].read(1024 * 1024), b""):
+                f.write(chunk)
+                size += len(chunk)
+
+        with self._file_lock(exclusive=True):
+            os.replace(tmp_path, path)
+            with open(f"{path}.json", "w") as f:
+                json.dump({"bucket": bucket_name, "key": item_name, "etag": file["ETag"], "size": size, "metadata": file.get("Metadata", {})}, f)
+            self._evict(keep=path)
+            opened = self._open(path)
+
+        with self._lock:
+            self._stats["misses"] += 1
+            self._stats["bytes_downloaded"] += size
+        return opened
+
+    def metadata(self, bucket_name: str, item_name: str):
+        """
+            Retrieves the user metadata of a cached object, None if not cached
+        """
+        with self._file_lock(exclusive=False):
+            meta = self._read_meta(self._path(bucket_name, item_name))
+        return meta.get("metadata", {}) if meta else None
+
+    def stats(self):
+        """
+            Retrieves cache counters of this process
+
+            Response:
+                stats:  <dict>
+                        hits, misses, evictions, bytes_downloaded
+        """
+        with self._lock:
+            return dict(self._stats)
+
+    def _path(self, bucket_name, item_name):
+        return os.path.join(self._cache_dir, hashlib.sha256(f"{bucket_name}/{item_name}".encode()).hexdigest())
+
+    def _read_meta(self, path):
+        try:
+            with open(f"{path}.json") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _open(self, path):
+        try:
+            with open(path, "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return io.BytesIO(b"")
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except OSError:
+            return None
+
+    def _evict(self, keep):
+        entries = []
+        for name in os.listdir(self._cache_dir):
+            path = os.path.join(self._cache_dir, name)
+            if name.endswith((".json", ".tmp", ".lock")) or path == keep:
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries) + os.path.getsize(keep)
+        for _, size, path in sorted(entries):
+            if total <= self._max_bytes:
+                break
+            for victim in (path, f"{path}.json"):
+                if os.path.exists(victim):
+                    os.remove(victim)
+            total -= size
+            with self._lock:
+                self._stats["evictions"] += 1
+
+    @contextmanager
+    def _file_lock(self, exclusive):
+        """
+            Host wide lock shared by every process using the cache directory
+        """
+        if fcntl is None:
+            with self._lock:
+                yield
+            return
+
+        with open(os.path.join(self._cache_dir, ".lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
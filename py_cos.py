@@ -1,68 +1,462 @@
 # Cloud object storage library imports
 import io
 import os
-import json
+import gzip
+import zlib
+import queue
+import logging
+import itertools
+import threading
 import ibm_boto3
+import pandas as pd
 
 from utils import *
+from py_cache import ObjectCache
+from py_metrics import REGISTRY, instrumented, record_bytes, record_error
+from collections import namedtuple
 from ibm_botocore.client import Config, ClientError
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
 
+# outcome of one key of a batch transfer, error is None when it succeeded
+TransferResult = namedtuple("TransferResult", ["key", "result", "error"])
+
+# maximum number of keys of one multi-object delete request
+DELETE_BATCH_SIZE = 1000
+
+# columnar formats handled by COS.read_dataframe / COS.write_dataframe
+COLUMNAR_SUFFIXES = {
+    ".parquet": "parquet",
+    ".pq": "parquet",
+    ".feather": "feather",
+    ".arrow": "feather",
+}
+
+# object codecs, picked from the item name suffix or the "codec" object metadata
+CODEC_SUFFIXES = {
+    ".gz": "gzip",
+    ".gzip": "gzip",
+    ".zst": "zstd",
+    ".zstd": "zstd",
+}
+
+# leading bytes of compressed data, they tell the actual codec of an object
+# whatever its name or metadata says
+CODEC_MAGIC = {
+    b"\x1f\x8b": "gzip",
+    b"\x28\xb5\x2f\xfd": "zstd",
+}
+
+logger = logging.getLogger(__name__)
+
+def _record_request(params=None, **kwargs):
+    """
+        before-call event handler counting the bytes sent by uploads, metrics
+        never fail the request
+    """
+    if not REGISTRY.enabled:
+        return
+    try:
+        size = params.get("headers", {}).get("Content-Length")
+        body = params.get("body")
+        if size is not None:
+            size = int(size)
+        elif isinstance(body, (bytes, bytearray, str)):
+            size = len(body)
+        elif hasattr(body, "seek") and hasattr(body, "tell"):
+            # seek of some transfer streams returns None, the size comes from tell
+            position = body.tell()
+            body.seek(0, io.SEEK_END)
+            size = body.tell() - position
+            body.seek(position)
+        else:
+            return
+        record_bytes("cos", "write", size)
+    except Exception as e:
+        logger.debug("Unable to count request bytes: %s", e)
+
+def _record_response(parsed=None, model=None, **kwargs):
+    """
+        after-call event handler counting retries and downloaded bytes, metrics
+        never fail the request
+    """
+    if not REGISTRY.enabled or not parsed:
+        return
+    try:
+        retries = parsed.get("ResponseMetadata", {}).get("RetryAttempts")
+        if retries:
+            REGISTRY.inc("retries_total", retries, component="cos", operation=model.name)
+        if model.name == "GetObject" and parsed.get("ContentLength"):
+            record_bytes("cos", "read", parsed["ContentLength"])
+    except Exception as e:
+        logger.debug("Unable to count response bytes: %s", e)
+
+def _codec(item_name, metadata=None, compression=None):
+    """
+        Resolves the codec of an object: explicit compression first, then the
+        item name suffix, then the codec recorded in the object metadata
+    """
+    if compression:
+        if compression not in ("gzip", "zstd"):
+            raise ValueError(f"Unsupported compression: {compression}")
+        return compression
+    suffix = os.path.splitext(item_name)[1].lower()
+    if suffix in CODEC_SUFFIXES:
+        return CODEC_SUFFIXES[suffix]
+    return (metadata or {}).get("codec")
+
+def _compressor(codec):
+    if codec == "gzip":
+        return zlib.compressobj(wbits=31)
+    import zstandard
+    return zstandard.ZstdCompressor().compressobj()
+
+def _decompress_stream(file, codec):
+    """
+        Wraps a readable binary stream so reads return decompressed data
+    """
+    if not codec:
+        return file
+    if codec == "gzip":
+        return gzip.GzipFile(fileobj=file, mode="rb")
+    import zstandard
+    return zstandard.ZstdDecompressor().stream_reader(file)
+
+def _sniff_codec(head):
+    """
+        Codec of data starting with head, None when it is not compressed
+    """
+    for magic, codec in CODEC_MAGIC.items():
+        if head[:len(magic)] == magic:
+            return codec
+    return None
+
+def _peek_codec(file):
+    """
+        Reads the leading bytes of a binary stream to tell its codec
+
+        Response:
+            codec:  <str>
+                    gzip / zstd, None when the data is not compressed
+            file:   <file>
+                    stream returning the whole data, peeked bytes included
+    """
+    head = b""
+    while len(head) < 4:
+        block = file.read(4 - len(head))
+        if not block:
+            break
+        head += block.encode() if isinstance(block, str) else block
+    return _sniff_codec(head), _PeekedReader(head, file)
+
+def _encode_upload(file, codec):
+    """
+        Prepares bytes or a binary stream for an upload as codec, data that is
+        already compressed is uploaded as is instead of being compressed twice
+
+        Response:
+            file:      <bytes | file>
+                       data to upload
+            metadata:  <dict>
+                       object metadata recording the codec, None without codec
+    """
+    if not codec:
+        return file, None
+    if isinstance(file, str):
+        file = file.encode()
+    if isinstance(file, (bytes, bytearray)):
+        compressed = _sniff_codec(file[:4])
+        if not compressed:
+            compressor = _compressor(codec)
+            file = compressor.compress(file) + compressor.flush()
+    else:
+        compressed, file = _peek_codec(file)
+        if not compressed:
+            file = _CompressingReader(file, codec)
+    return file, {"codec": compressed or codec}
+
+class _PeekedReader(io.RawIOBase):
+
+    def __init__(self, head, file):
+        """
+            Readable stream returning head followed by the rest of file
+        """
+        self._head = head
+        self._file = file
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            data = self._head + self._file.read()
+            self._head = b""
+            return data
+        if self._head:
+            data = self._head[:size]
+            self._head = self._head[size:]
+            return data
+        return self._file.read(size)
+
+class _CompressingReader(io.RawIOBase):
+
+    def __init__(self, file, codec, block_size=1024 * 1024):
+        """
+            Readable stream returning the compressed contents of file, data is
+            compressed block by block as it is read
+        """
+        self._file = file
+        self._compressor = _compressor(codec)
+        self._block_size = block_size
+        self._buffer = bytearray()
+        self._eof = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def read(self, size=-1):
+        while not self._eof and (size is None or size < 0 or len(self._buffer) < size):
+            block = self._file.read(self._block_size)
+            if isinstance(block, str):
+                block = block.encode()
+            if block:
+                self._buffer += self._compressor.compress(block)
+            else:
+                self._buffer += self._compressor.flush()
+                self._eof = True
+
+        if size is None or size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+class _RangedObject(io.RawIOBase):
+
+    def __init__(self, cos_cli, bucket_name, item_name, size, block_size=1024 * 1024):
+        """
+            Seekable read only file over a COS object, every read is served by a
+            ranged GET so readers such as pyarrow only download what they touch.
+            Reads smaller than block_size fetch a whole block that serves the
+            following small reads, e.g. the parquet footer.
+        """
+        self._cos_cli = cos_cli
+        self._bucket_name = bucket_name
+        self._item_name = item_name
+        self._size = size
+        self._block_size = block_size
+        self._position = 0
+        self._block_start = 0
+        self._block = b""
+        self.bytes_transferred = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._size
+        self._position = max(0, min(offset, self._size))
+        return self._position
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self._size - self._position
+        size = min(size, self._size - self._position)
+        if size <= 0:
+            return b""
+
+        offset = self._position - self._block_start
+        if not (0 <= offset and offset + size <= len(self._block)):
+            length = max(size, self._block_size)
+            last = min(self._position + length, self._size) - 1
+            file = self._cos_cli.get_object(Bucket=self._bucket_name, Key=self._item_name, Range=f"bytes={self._position}-{last}")
+            self._block = file["Body"].read()
+            self._block_start = self._position
+            self.bytes_transferred += len(self._block)
+            offset = 0
+
+        data = self._block[offset:offset + size]
+        self._position += len(data)
+        return data
+
+class _MultipartWriter(io.RawIOBase):
+
+    def __init__(self, cos_cli, bucket_name, item_name, part_size, concurrency, executor, metadata=None):
+        """
+            Writable file that uploads its contents as multipart upload parts
+            while it is being written. At most concurrency parts are in flight,
+            further writes block until one of them completes, so memory stays
+            around (concurrency + 1) * part_size. Contents that never reach
+            part_size are sent with a single put_object on close.
+        """
+        self._cos_cli = cos_cli
+        self._bucket_name = bucket_name
+        self._item_name = item_name
+        self._part_size = part_size
+        self._metadata = metadata or {}
+        self._executor = executor
+        self._slots = threading.Semaphore(concurrency)
+        self._buffer = bytearray()
+        self._upload_id = None
+        self._futures = []
+        self._written = 0
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self._written
+
+    def write(self, data):
+        self._buffer += data
+        self._written += len(data)
+        while len(self._buffer) >= self._part_size:
+            part = bytes(self._buffer[:self._part_size])
+            del self._buffer[:self._part_size]
+            self._submit(part)
+        return len(data)
+
+    def _submit(self, part):
+        if self._upload_id is None:
+            self._upload_id = self._cos_cli.create_multipart_upload(Bucket=self._bucket_name, Key=self._item_name, Metadata=self._metadata)["UploadId"]
+
+        part_number = len(self._futures) + 1
+        self._slots.acquire()
+
+        def upload():
+            try:
+                response = self._cos_cli.upload_part(
+                    Bucket=self._bucket_name,
+                    Key=self._item_name,
+                    UploadId=self._upload_id,
+                    PartNumber=part_number,
+                    Body=part)
+                return {"PartNumber": part_number, "ETag": response["ETag"]}
+            finally:
+                self._slots.release()
+
+        self._futures.append(self._executor.submit(upload))
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self._upload_id is None:
+                self._cos_cli.put_object(Bucket=self._bucket_name, Key=self._item_name, Body=bytes(self._buffer), Metadata=self._metadata)
+            else:
+                if self._buffer:
+                    self._submit(bytes(self._buffer))
+                parts = [future.result() for future in self._futures]
+                self._cos_cli.complete_multipart_upload(
+                    Bucket=self._bucket_name,
+                    Key=self._item_name,
+                    UploadId=self._upload_id,
+                    MultipartUpload={"Parts": parts})
+            self._buffer = bytearray()
+        except Exception:
+            self.abort()
+            raise
+        finally:
+            super().close()
+
+    def abort(self):
+        """
+            Cancels the upload, parts already sent are discarded
+        """
+        for future in self._futures:
+            future.cancel()
+        if self._upload_id is not None:
+            wait(self._futures)
+            self._cos_cli.abort_multipart_upload(Bucket=self._bucket_name, Key=self._item_name, UploadId=self._upload_id)
+            self._upload_id = None
+
+@instrumented("cos")
 class COS():
 
-    def __init__(self):
+    def __init__(self, max_workers: int=16, cache_dir: str=None, cache_bytes: int=1024 * 1024 * 1024):
         """
             Initializes COS class by:
                 1. initializing ibm_boto3 COS resource portal
                 2. initializing ibm_boto3 COS client portal
                 3. initializing ibm_boto3 transfer configuration settings
+
+            Requests are authenticated with the IAM api key of the credentials,
+            or with their cos_hmac_keys when present.
+
+            Parameters:
+                max_workers:  <int>
+                              default number of concurrent transfers of batch
+                              operations, the client connection pool is sized to match
+                cache_dir:    <str>
+                              optional local directory caching downloaded objects,
+                              revalidated against their ETag on every read
+                cache_bytes:  <int>
+                              disk budget of the object cache
         """
 
-        if 'VCAP_SERVICES' in os.environ:
-            vcap = json.loads(os.getenv('VCAP_SERVICES'))
-            print('Found VCAP_SERVICES')
+        # Cloud object storage
+        s3Credential = get_service_credentials('cloud-object-storage')
+        COS_ENDPOINT = os.getenv('COS_ENDPOINT') #'https://s3.us-east.cloud-object-storage.appdomain.cloud'
+        COS_AUTH_ENDPOINT = "https://iam.cloud.ibm.com/identity/token"
 
-            # Cloud object storage
-            if 'cloud-object-storage' in vcap:
-                s3Credential = vcap['cloud-object-storage'][0]['credentials']
-                COS_ENDPOINT = os.getenv('COS_ENDPOINT') #'https://s3.us-east.cloud-object-storage.appdomain.cloud'
-                COS_API_KEY_ID = s3Credential['apikey']
-                COS_AUTH_ENDPOINT = "https://iam.cloud.ibm.com/identity/token"
-                COS_RESOURCE_CRN = s3Credential['resource_instance_id']
-            else:
-                raise MissingCreds("COS creds not fouund in OS Environment!")
-        elif os.path.isfile('vcap_services.json'):
-            with open('vcap_services.json') as f:
-                vcap = json.load(f)
-                print('Found local VCAP_SERVICES')
-
-                # Cloud object storage
-                if 'cloud-object-storage' in vcap:
-                    s3Credential = vcap['cloud-object-storage'][0]['credentials']
-                    COS_ENDPOINT = os.getenv('COS_ENDPOINT') #'https://s3.us-east.cloud-object-storage.appdomain.cloud'
-                    COS_API_KEY_ID = s3Credential['apikey']
-                    COS_AUTH_ENDPOINT = "https://iam.cloud.ibm.com/identity/token"
-                    COS_RESOURCE_CRN = s3Credential['resource_instance_id']
-                else:
-                    raise MissingCreds("Local COS creds not found!")
+        if "cos_hmac_keys" in s3Credential:
+            # HMAC credentials sign requests with AWS signature v4, as used by
+            # S3 compatible endpoints
+            auth = {
+                "aws_access_key_id": s3Credential["cos_hmac_keys"]["access_key_id"],
+                "aws_secret_access_key": s3Credential["cos_hmac_keys"]["secret_access_key"]}
+            signature_version = "s3v4"
         else:
-            raise MissingCreds("VCAP_SERVICES Not found in OS Environment!")
-            
+            auth = {
+                "ibm_api_key_id": s3Credential['apikey'],
+                "ibm_service_instance_id": s3Credential['resource_instance_id'],
+                "ibm_auth_endpoint": COS_AUTH_ENDPOINT}
+            signature_version = "oauth"
 
         self._cos_re = ibm_boto3.resource(
             service_name="s3",
-            ibm_api_key_id=COS_API_KEY_ID,
-            ibm_service_instance_id=COS_RESOURCE_CRN,
             endpoint_url=COS_ENDPOINT,
-            ibm_auth_endpoint=COS_AUTH_ENDPOINT,
-            config=Config(signature_version="oauth"))
+            config=Config(signature_version=signature_version),
+            **auth)
 
         self._cos_cli = ibm_boto3.client(
             service_name="s3",
-            ibm_api_key_id=COS_API_KEY_ID,
-            ibm_service_instance_id=COS_RESOURCE_CRN,
             endpoint_url=COS_ENDPOINT,
-            ibm_auth_endpoint=COS_AUTH_ENDPOINT,
-            config=Config(signature_version="oauth"))
+            config=Config(signature_version=signature_version, max_pool_connections=max(10, max_workers)),
+            **auth)
+
+        self._max_workers = max_workers
+        self._object_cache = ObjectCache(cache_dir, cache_bytes) if cache_dir else None
+
+        for client in (self._cos_cli, self._cos_re.meta.client):
+            client.meta.events.register("before-call.s3.PutObject", _record_request)
+            client.meta.events.register("before-call.s3.UploadPart", _record_request)
+            client.meta.events.register("after-call.s3", _record_response)
+        if self._object_cache is not None:
+            REGISTRY.register_collector("cos_cache", self._object_cache.stats, instance=hex(id(self._object_cache)))
 
         self._transfer_config = ibm_boto3.s3.transfer.TransferConfig(
                 # set chunksize to 5 MB chunks
@@ -79,34 +473,38 @@ class COS():
                 cos_bucket_location: <str>
                                      regional location of COS bucket
         """
-        print(f"Creating new bucket: {bucket_name}")
+        logger.info("Creating new bucket: %s", bucket_name)
         try:
             self._cos_re.Bucket(bucket_name).create(CreateBucketConfiguration={"LocationConstraint":cos_bucket_location})
-            print(f"Bucket: {bucket_name} created!")
+            logger.info("Bucket: %s created!", bucket_name)
         except ClientError as be:
-            print(f"CLIENT ERROR: {be}")
+            logger.error("CLIENT ERROR: %s", be)
+            record_error(be)
         except Exception as e:
-            print(f"Unable to create bucket: {e}")
+            logger.error("Unable to create bucket: %s", e)
+            record_error(e)
 
     def get_buckets(self):
         """
             Retrieves list of avaliable buckets
         """
-        print("Retrieving list of buckets")
+        logger.info("Retrieving list of buckets")
         try:
             buckets = self._cos_re.buckets.all()
             buckets = [bucket.name for bucket in buckets]
         except ClientError as be:
-            print(f"CLIENT ERROR: {be}")
+            logger.error("CLIENT ERROR: %s", be)
+            record_error(be)
         except Exception as e:
-            print(f"Unable to retrieve list buckets: {e}")
+            logger.error("Unable to retrieve list buckets: %s", e)
+            record_error(e)
         else:
             return buckets
 
     def get_bucket_contents(self, bucket_name, prefix="", max_keys=100000):
         """
-            Retrieves list of bucket contents with limit of 100000 list entries
-            by default unless limit is otherwise specified
+            Retrieves list of bucket contents, max_keys entries are requested
+            per listing page
             Parameters:
                 bucket_name:  <str>
                               name of target bucket
@@ -114,72 +512,570 @@ class COS():
                               file prefix in order to locate file if in folder structure
                               directory environment
                 max_keys:     <int>
-                              limit or number of files keys to retrieve
+                              limit or number of files keys to retrieve per page
             Response:
                 files:        <list>
                               list of file names in target bucket
         """
-        print("Retrieving bucket contents from: {0}".format(bucket_name))
+        logger.info("Retrieving bucket contents from: %s", bucket_name)
         try:
-            # create client object
-            files = []
-            next_token = ""
-            more_results = True
-
-            while (more_results):
-                if prefix:
-                    response = self._cos_cli.list_objects_v2(
-                        Prefix=prefix,
-                        Bucket=bucket_name, 
-                        MaxKeys=max_keys, 
-                        ContinuationToken=next_token)
-                else:
-                    response = self._cos_cli.list_objects_v2(
-                        Bucket=bucket_name, 
-                        MaxKeys=max_keys, 
-                        ContinuationToken=next_token)
-                
-                batch_files = [file["Key"] for file in response["Contents"]]
-                files.extend(batch_files)
-
-                if response["IsTruncated"]:
-                    next_token = response["NextContinuationToken"]
-                else:
-                    next_token = ""
-                    more_results = False
-
+            files = list(self.iter_bucket_contents(bucket_name, prefix, page_size=max_keys, metadata=False))
         except ClientError as be:
-            print("CLIENT ERROR: {0}\n".format(be))
+            logger.error("CLIENT ERROR: %s", be)
+            record_error(be)
         except Exception as e:
-            print("Unable to retrieve bucket contents: {0}".format(e))
+            logger.error("Unable to retrieve bucket contents: %s", e)
+            record_error(e)
         else:
             return files
 
-    def get_item(self, bucket_name, item_name):
+    def iter_bucket_contents(self, bucket_name, prefix="", page_size=1000, metadata=True):
+        """
+            Lazily lists bucket contents page by page, only one page of keys is
+            held in memory at a time
+            Parameters:
+                bucket_name:  <str>
+                              name of target bucket
+                prefix:       <str>
+                              only list keys starting with prefix
+                page_size:    <int>
+                              keys requested per listing page
+                metadata:     <bool>
+                              yield dicts with Key, Size, ETag and LastModified
+                              instead of key names
+            Response:
+                files:        <generator>
+                              key names or metadata dicts
+        """
+        paginator = self._cos_cli.get_paginator("list_objects_v2")
+        pages = paginator.paginate(Bucket=bucket_name, Prefix=prefix, PaginationConfig={"PageSize": page_size})
+        for page in pages:
+            for file in page.get("Contents", []):
+                yield self._listing_entry(file, metadata)
+
+    def list_bucket_parallel(self, bucket_name, prefix="", delimiter="/", max_workers=None, metadata=True):
+        """
+            Lists bucket contents by discovering the sub-prefixes of prefix with
+            delimiter and listing each sub-prefix on concurrent workers.
+
+            Keys are yielded as pages arrive, so the order is not sorted. A
+            bounded queue between the workers and the consumer keeps memory
+            stable when the consumer is slower than the listing.
+
+            Parameters:
+                bucket_name:  <str>
+                              name of target bucket
+                prefix:       <str>
+                              only list keys starting with prefix
+                delimiter:    <str>
+                              separator of the sub-prefixes to fan out on
+                max_workers:  <int>
+                              concurrent listings, COS max_workers by default
+                metadata:     <bool>
+                              yield dicts with Key, Size, ETag and LastModified
+                              instead of key names
+            Response:
+                files:        <generator>
+                              key names or metadata dicts
+        """
+        sub_prefixes = []
+        paginator = self._cos_cli.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix, Delimiter=delimiter):
+            for file in page.get("Contents", []):
+                yield self._listing_entry(file, metadata)
+            sub_prefixes.extend(common["Prefix"] for common in page.get("CommonPrefixes", []))
+
+        if not sub_prefixes:
+            return
+
+        max_workers = max_workers or self._max_workers
+        pages = queue.Queue(maxsize=max_workers * 4)
+        stop = threading.Event()
+        done = object()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+
+        def list_prefix(sub_prefix):
+            try:
+                for page in paginator.paginate(Bucket=bucket_name, Prefix=sub_prefix):
+                    if stop.is_set():
+                        return
+                    put(page.get("Contents", []))
+            except Exception as e:
+                put(e)
+            finally:
+                put(done)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for sub_prefix in sub_prefixes:
+                executor.submit(list_prefix, sub_prefix)
+
+            try:
+                remaining = len(sub_prefixes)
+                while remaining:
+                    item = pages.get()
+                    if item is done:
+                        remaining -= 1
+                    elif isinstance(item, Exception):
+                        raise item
+                    else:
+                        for file in item:
+                            yield self._listing_entry(file, metadata)
+            finally:
+                stop.set()
+
+    @staticmethod
+    def _listing_entry(file, metadata):
+        if not metadata:
+            return file["Key"]
+        return {
+            "Key": file["Key"],
+            "Size": file.get("Size"),
+            "ETag": file.get("ETag"),
+            "LastModified": file.get("LastModified"),
+        }
+
+    def get_item(self, bucket_name, item_name, chunksize: int=None, byte_range: tuple=None):
         """
             Retrieves target file in target bucket
+            gzip and zstd compressed items are decompressed while the body is
+            read, the codec is told by the leading bytes of the object.
+
             Parameters:
                 bucket_name:  <str>
                               name of target bucket
                 item_name:    <str>
                               name of target file in bucket
+                chunksize:    <int>
+                              stream the response body into a chunked csv reader
+                              yielding dataframes of chunksize rows, so only one
+                              chunk is held in memory at a time
+                byte_range:   <tuple>
+                              (first, last) byte offsets, both inclusive, to read
+                              only part of the file. Partial lines at either end
+                              are dropped and the header is taken from the start
+                              of the file, e.g. (0, 1024 * 1024) reads the head.
+                              Compressed items cannot be split, they are read
+                              as a whole
             Response:
                 item:        <dict>
-                             target item contents in dict format 
+                             target item contents in dict format, an iterator of
+                             dataframes with chunksize
         """
-        print(f"Retrieving item from bucket: {bucket_name}, key: {item_name}")
+        logger.info("Retrieving item from bucket: %s, key: %s", bucket_name, item_name)
         try:
-            file = self._cos_re.Object(bucket_name, item_name).get()
+            if byte_range:
+                item = self._read_csv_range(bucket_name, item_name, *byte_range)
+                if item is not None:
+                    return item
+                logger.warning("%s is compressed, reading it as a whole instead of bytes %s-%s", item_name, *byte_range)
+            file = self._open_object(bucket_name, item_name)
         except ClientError as be:
-            print(f"CLIENT ERROR: {be}")
+            logger.error("CLIENT ERROR: %s", be)
+            record_error(be)
         except Exception as e:
-            print(f"Unable to retrieve file contents: {e}")
+            logger.error("Unable to retrieve file contents: %s", e)
+            record_error(e)
         else:
-            file = io.BytesIO(file["Body"].read())
+            if chunksize:
+                return pd.read_csv(file, chunksize=chunksize)
             item = pd.read_csv(file)
             return item
 
-    def upload_file_cos(self, bucket_name, item_name, file):
+    def get_item_parallel(self, bucket_name, item_name, part_size: int=1024 * 1024 * 64, max_workers: int=None):
+        """
+            Retrieves a large csv file by downloading byte ranges of part_size
+            concurrently, cutting them at line boundaries and parsing the parts
+            on concurrent workers.
+
+            Lines are split on newlines, files with newlines inside quoted
+            values must be read with get_item instead. Compressed items cannot
+            be split, they are read with get_item, or decompressed as a whole
+            once downloaded when neither their name nor metadata tells the codec.
+
+            Parameters:
+                bucket_name:  <str>
+                              name of target bucket
+                item_name:    <str>
+                              name of target file in bucket
+                part_size:    <int>
+                              bytes per ranged request
+                max_workers:  <int>
+                              concurrent requests, COS max_workers by default
+            Response:
+                item:         <pandas dataframe>
+                              target item contents
+        """
+        logger.info("Retrieving item from bucket: %s, key: %s", bucket_name, item_name)
+        head = self._cos_cli.head_object(Bucket=bucket_name, Key=item_name)
+        if _codec(item_name, head.get("Metadata")):
+            return self.get_item(bucket_name, item_name)
+        size = head["ContentLength"]
+        ranges = [(start, min(start + part_size, size) - 1) for start in range(0, size, part_size)]
+
+        with ThreadPoolExecutor(max_workers=max_workers or self._max_workers) as executor:
+            chunks = list(executor.map(lambda byte_range: self._get_range(bucket_name, item_name, *byte_range), ranges))
+
+            codec = _sniff_codec(chunks[0][:4]) if chunks else None
+            if codec:
+                return pd.read_csv(_decompress_stream(io.BytesIO(b"".join(chunks)), codec))
+
+            # every part ends on a newline, the partial last line of a chunk is
+            # carried over to the next part
+            parts = []
+            carry = b""
+            for chunk in chunks[:-1]:
+                cut = chunk.rfind(b"\n")
+                if cut == -1:
+                    carry += chunk
+                    continue
+                parts.append(carry + chunk[:cut + 1])
+                carry = chunk[cut + 1:]
+            parts.append(carry + (chunks[-1] if chunks else b""))
+            del chunks
+
+            columns = pd.read_csv(io.BytesIO(parts[0]), nrows=0).columns
+            frames = list(executor.map(
+                lambda i: pd.read_csv(io.BytesIO(parts[i])) if i == 0 else pd.read_csv(io.BytesIO(parts[i]), header=None, names=columns),
+                [i for i in range(len(parts)) if parts[i].strip()]))
+
+        return pd.concat(frames, ignore_index=True)
+
+    def _get_range(self, bucket_name, item_name, first, last):
+        file = self._cos_cli.get_object(Bucket=bucket_name, Key=item_name, Range=f"bytes={first}-{last}")
+        return file["Body"].read()
+
+    def _read_csv_range(self, bucket_name, item_name, first, last):
+        """
+            Parses the complete lines of a byte range of a csv file, None when
+            the object is compressed and cannot be split
+        """
+        # one byte before the range is fetched too, it tells whether the range
+        # starts on a line boundary
+        start = max(first - 1, 0)
+        file = self._cos_cli.get_object(Bucket=bucket_name, Key=item_name, Range=f"bytes={start}-{last}")
+        data = file["Body"].read()
+        size = int(file["ContentRange"].rsplit("/", 1)[1])
+        end = start + len(data)
+
+        head = self._get_range(bucket_name, item_name, 0, 64 * 1024) if first > 0 else data
+        if _codec(item_name, file.get("Metadata")) or _sniff_codec(head):
+            return None
+
+        if first > 0:
+            starts_on_line = data[:1] == b"\n"
+            data = data[1:]
+            if not starts_on_line:
+                data = data.split(b"\n", 1)[1] if b"\n" in data else b""
+
+        # the last line is partial unless the range reaches the end of the file
+        if end < size:
+            data = data[:data.rfind(b"\n") + 1]
+
+        if first == 0:
+            return pd.read_csv(io.BytesIO(data))
+
+        header = head.split(b"\n", 1)[0]
+        columns = pd.read_csv(io.BytesIO(header + b"\n"), nrows=0).columns
+        if not data.strip():
+            return pd.DataFrame(columns=columns)
+        return pd.read_csv(io.BytesIO(data), header=None, names=columns)
+
+    def read_dataframe(self, bucket_name, item_name, columns: list=None, filters: list=None, format: str=None):
+        """
+            Retrieves a parquet or feather file as dataframe
+
+            The object is read through ranged GETs: for parquet the footer is
+            fetched first and then only the column chunks of the requested columns
+            in the row groups whose statistics can match filters.
+
+            Parameters:
+                bucket_name:  <str>
+                              name of target bucket
+                item_name:    <str>
+                              name of target file in bucket
+                columns:      <list>
+                              columns to retrieve, all columns when None
+                filters:      <list>
+                              pyarrow filters, e.g. [("date", ">=", "2021-01-01")]
+                format:       <str>
+                              parquet or feather, inferred from the item name suffix
+            Response:
+                item:         <pandas dataframe>
+                              target item contents
+        """
+        import pyarrow.parquet as pq
+        import pyarrow.feather as feather
+
+        format = format or self._columnar_format(item_name)
+        logger.info("Retrieving %s item from bucket: %s, key: %s", format, bucket_name, item_name)
+        size = self._cos_cli.head_object(Bucket=bucket_name, Key=item_name)["ContentLength"]
+        source = _RangedObject(self._cos_cli, bucket_name, item_name, size)
+
+        if format == "parquet":
+            table = pq.read_table(source, columns=columns, filters=filters)
+        else:
+            table = feather.read_table(source, columns=columns)
+            if filters:
+                table = table.filter(pq.filters_to_expression(filters))
+
+        logger.info("Transferred %s of %s bytes", source.bytes_transferred, size)
+        return table.to_pandas()
+
+    def write_dataframe(self, df, bucket_name, item_name, format: str=None, compression: str=None):
+        """
+            Uploads a dataframe as parquet or feather file
+
+            Parameters:
+                df:           <pandas dataframe>
+                              dataframe to upload
+                bucket_name:  <str>
+                              name of target bucket
+                item_name:    <str>
+                              name of target file in bucket
+                format:       <str>
+                              parquet or feather, inferred from the item name suffix
+                compression:  <str>
+                              codec, e.g. snappy, zstd, lz4, defaults to the
+                              pyarrow default of the format
+
+            Upload errors are raised, unlike upload_file_cos.
+        """
+        format = format or self._columnar_format(item_name)
+        buffer = io.BytesIO()
+        kwargs = {"compression": compression} if compression else {}
+        if format == "parquet":
+            df.to_parquet(buffer, index=False, **kwargs)
+        else:
+            df.reset_index(drop=True).to_feather(buffer, **kwargs)
+        buffer.seek(0)
+        logger.info("Starting file transfer for %s to bucket: %s", item_name, bucket_name)
+        self._cos_cli.upload_fileobj(
+            Fileobj=buffer,
+            Bucket=bucket_name,
+            Key=item_name,
+            Config=self._transfer_config)
+        logger.info("Transfer for %s Complete!", item_name)
+
+    def upload_dataframe(self, df, bucket_name, item_name, format: str="csv", compression: str=None, chunk_rows: int=100000, max_workers: int=None):
+        """
+            Uploads a dataframe by serializing it chunk_rows rows at a time straight
+            into concurrent multipart upload parts, so serialization and transfer
+            overlap and the serialized object is never held in memory as a whole.
+
+            Part size and the number of parts in flight are picked from the in
+            memory size of the dataframe, see _upload_plan.
+
+            Parameters:
+                df:           <pandas dataframe>
+                              dataframe to upload
+                bucket_name:  <str>
+                              name of target bucket
+                item_name:    <str>
+                              name of target file in bucket
+                format:       <str>
+                              csv or parquet, each chunk becomes a parquet row group
+                compression:  <str>
+                              csv: gzip / zstd, inferred from a .gz / .zst suffix,
+                              parquet: any pyarrow codec (snappy default)
+                chunk_rows:   <int>
+                              rows serialized at a time
+                max_workers:  <int>
+                              upper bound of parts in flight, COS max_workers by default
+        """
+        estimate = int(df.memory_usage(deep=True).sum())
+        part_size, concurrency = self._upload_plan(estimate, max_workers or self._max_workers)
+        logger.info("Starting dataframe upload for %s to bucket: %s (%s MB parts, %s in flight)", item_name, bucket_name, part_size // (1024 * 1024), concurrency)
+
+        metadata = None
+        if format == "csv":
+            compression = _codec(item_name, compression=compression)
+            metadata = {"codec": compression} if compression else None
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            writer = _MultipartWriter(self._cos_cli, bucket_name, item_name, part_size, concurrency, executor, metadata)
+            try:
+                if format == "parquet":
+                    import pyarrow as pa
+                    import pyarrow.parquet as pq
+
+                    # types are inferred from every row, an empty slice would type
+                    # object columns as null and reject the first chunk with values
+                    schema = pa.Schema.from_pandas(df, preserve_index=False)
+                    with pq.ParquetWriter(writer, schema, compression=compression or "snappy") as parquet:
+                        for start in range(0, len(df), chunk_rows):
+                            parquet.write_table(pa.Table.from_pandas(df.iloc[start:start + chunk_rows], schema=schema, preserve_index=False))
+                elif format == "csv":
+                    stream = self._compress_stream(writer, compression)
+                    for start in range(0, max(len(df), 1), chunk_rows):
+                        stream.write(df.iloc[start:start + chunk_rows].to_csv(index=False, header=start == 0).encode())
+                    if stream is not writer:
+                        stream.close()
+                else:
+                    raise ValueError(f"Unsupported format: {format}")
+                writer.close()
+            except Exception:
+                writer.abort()
+                raise
+        logger.info("Transfer for %s Complete!", item_name)
+
+    @staticmethod
+    def _upload_plan(estimate, max_workers):
+        """
+            Picks part size and concurrency for an object of about estimate bytes:
+            roughly 64 parts between 8 MB and 512 MB each, which keeps large
+            objects far below the 10000 parts limit, and as many parts in flight
+            as there are parts up to max_workers
+        """
+        part_size = min(max(estimate // 64, 8 * 1024 * 1024), 512 * 1024 * 1024)
+        concurrency = max(1, min(max_workers, -(-estimate // part_size)))
+        return part_size, concurrency
+
+    @staticmethod
+    def _compress_stream(raw, compression):
+        """
+            Wraps a writable binary stream so data written to it is compressed
+            on the fly, closing the wrapper flushes the codec without closing raw
+        """
+        if not compression:
+            return raw
+        if compression == "gzip":
+            return gzip.GzipFile(fileobj=raw, mode="wb")
+        import zstandard
+        return zstandard.ZstdCompressor().stream_writer(raw, closefd=False)
+
+    @staticmethod
+    def _columnar_format(item_name):
+        suffix = os.path.splitext(item_name)[1].lower()
+        if suffix not in COLUMNAR_SUFFIXES:
+            raise ValueError(f"Unable to infer columnar format of {item_name}, pass format")
+        return COLUMNAR_SUFFIXES[suffix]
+
+    def get_items(self, bucket_name, item_names, max_workers: int=None, ordered: bool=True, concat: bool=False):
+        """
+            Retrieves several csv files of a bucket concurrently
+
+            A failed key does not abort the batch, its error is reported in the
+            result of that key instead.
+
+            Parameters:
+                bucket_name:  <str>
+                              name of target bucket
+                item_names:   <list>
+                              names of target files in bucket
+                max_workers:  <int>
+                              concurrent downloads, COS max_workers by default
+                ordered:      <bool>
+                              return results in item_names order, otherwise yield
+                              them as downloads complete
+                concat:       <bool>
+                              concatenate every retrieved file into one dataframe,
+                              in item_names order
+            Response:
+                results:      <list | generator>
+                              TransferResult(key, dataframe, error) per key
+                              (df, failures) with concat, failures being the
+                              TransferResult of every key that failed
+        """
+        results = self._run_batch(self._read_csv, bucket_name, item_names, max_workers, ordered or concat, "get_items")
+
+        if concat:
+            results = list(results)
+            frames = [result.result for result in results if result.error is None]
+            failures = [result for result in results if result.error is not None]
+            df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+            return df, failures
+        return results
+
+    def upload_many(self, bucket_name, items, max_workers: int=None, ordered: bool=True):
+        """
+            Uploads several files to target bucket concurrently
+
+            Parameters:
+                bucket_name:  <str>
+                              name of target bucket
+                items:        <dict | list>
+                              item name -> file (bytes or binary file object), or
+                              list of (item name, file) pairs. Files are compressed
+                              as in upload_file_cos
+                max_workers:  <int>
+                              concurrent uploads, COS max_workers by default
+                ordered:      <bool>
+                              return results in items order, otherwise yield them
+                              as uploads complete
+            Response:
+                results:      <list | generator>
+                              TransferResult(key, None, error) per key
+        """
+        items = list(items.items()) if isinstance(items, dict) else list(items)
+        files = dict(items)
+
+        def upload(bucket_name, item_name):
+            file, metadata = _encode_upload(files[item_name], _codec(item_name))
+            if isinstance(file, (bytes, bytearray)):
+                file = io.BytesIO(file)
+            self._cos_cli.upload_fileobj(
+                Fileobj=file,
+                Bucket=bucket_name,
+                Key=item_name,
+                ExtraArgs={"Metadata": metadata} if metadata else None,
+                Config=self._transfer_config)
+
+        return self._run_batch(upload, bucket_name, [item_name for item_name, _ in items], max_workers, ordered, "upload_many")
+
+    def _read_csv(self, bucket_name, item_name):
+        return pd.read_csv(self._open_object(bucket_name, item_name))
+
+    def _open_object(self, bucket_name, item_name):
+        """
+            Opens an object for reading, through the local object cache when the
+            instance has one, otherwise as the streaming response body.
+            Compressed objects are decompressed as they are read, whatever their
+            name or metadata says the codec is told by their leading bytes.
+        """
+        if self._object_cache is not None:
+            file = self._object_cache.get(self._cos_cli, bucket_name, item_name)
+        else:
+            file = self._cos_cli.get_object(Bucket=bucket_name, Key=item_name)["Body"]
+        codec, file = _peek_codec(file)
+        return _decompress_stream(file, codec)
+
+    def _run_batch(self, transfer, bucket_name, item_names, max_workers, ordered, method):
+        """
+            Runs transfer(bucket_name, item_name) for every item on a bounded
+            thread pool, sharing the thread safe _cos_cli client. Failures are
+            counted as errors of method.
+        """
+        item_names = list(item_names)
+        executor = ThreadPoolExecutor(max_workers=max_workers or self._max_workers)
+
+        def run(item_name):
+            try:
+                return TransferResult(item_name, transfer(bucket_name, item_name), None)
+            except Exception as e:
+                logger.error("Transfer of %s failed: %s", item_name, e)
+                record_error(e, "cos", method)
+                return TransferResult(item_name, None, e)
+
+        if ordered:
+            with executor:
+                return list(executor.map(run, item_names))
+
+        def completed():
+            with executor:
+                futures = [executor.submit(run, item_name) for item_name in item_names]
+                for future in as_completed(futures):
+                    yield future.result()
+
+        return completed()
+
+    def upload_file_cos(self, bucket_name, item_name, file, compression: str=None):
         """
             Uploads to target bucket
             Parameters:
@@ -189,17 +1085,28 @@ class COS():
                               name of target file in bucket
                 file:         <bytes>
                               binarized version of file to be uploaded
+                compression:  <str>
+                              gzip / zstd, inferred from a .gz / .zst item name
+                              suffix. The file is compressed while it is uploaded,
+                              unless it is compressed already, and the codec is
+                              recorded in the object metadata
         """        
         try:
-            print(f"Starting file transfer for {item_name} to bucket: {bucket_name}")
+            logger.info("Starting file transfer for %s to bucket: %s", item_name, bucket_name)
+            file, metadata = _encode_upload(file, _codec(item_name, compression=compression))
+            if isinstance(file, (bytes, bytearray)):
+                file = io.BytesIO(file)
             self._cos_re.Object(bucket_name, item_name).upload_fileobj(
                 Fileobj=file,
+                ExtraArgs={"Metadata": metadata} if metadata else None,
                 Config=self._transfer_config)
-            print(f"Transfer for {item_name} Complete!")
+            logger.info("Transfer for %s Complete!", item_name)
         except ClientError as be:
-            print(f"CLIENT ERROR: {be}")
+            logger.error("CLIENT ERROR: %s", be)
+            record_error(be)
         except Exception as e:
-            print(f"Unable to complete multi-part upload: {e}")
+            logger.error("Unable to complete multi-part upload: %s", e)
+            record_error(e)
 
     def delete_file_cos(self, bucket_name, item_name):
         """
@@ -210,43 +1117,131 @@ class COS():
                 item_name:    <str>
                               name of target file in bucket
         """    
-        print(f"Deleting item: {item_name}")
+        logger.info("Deleting item: %s", item_name)
         try:
             self._cos_re.Object(bucket_name, item_name).delete()
         except ClientError as be:
-            print(f"CLIENT ERROR: {be}")
+            logger.error("CLIENT ERROR: %s", be)
+            record_error(be)
         except Exception as e:
-            print(f"Unable to delete item: {e}")
+            logger.error("Unable to delete item: %s", e)
+            record_error(e)
 
-    # TODO: may need to create a function to empty bucket contents first before deleting
-    def delete_bucket(self, bucket_name):
+    def delete_many(self, bucket_name, keys: list=None, prefix: str=None, max_workers: int=None):
+        """
+            Deletes many files of target bucket with multi-object delete requests
+            of up to 1000 keys, sent by concurrent workers while the keys are
+            still being listed
+            Parameters:
+                bucket_name:     <str>
+                                 name of target bucket
+                keys:            <list>
+                                 iterable of key names to delete
+                prefix:          <str>
+                                 key prefix whose files are all deleted instead of
+                                 keys, "" empties the bucket
+                max_workers:     <int>
+                                 concurrent delete requests, COS max_workers by default
+            Response:
+                errors:          <list>
+                                 {"Key", "Code", "Message"} of every key that could
+                                 not be deleted
+        """
+        if isinstance(keys, (str, bytes)):
+            raise TypeError("keys must be an iterable of key names, pass a prefix as prefix=")
+        if (keys is None) == (prefix is None):
+            raise ValueError("Pass either keys or prefix")
+
+        logger.info("Deleting items from bucket: %s", bucket_name)
+        if prefix is not None:
+            keys = self.iter_bucket_contents(bucket_name, prefix, metadata=False)
+        else:
+            keys = iter(keys)
+
+        max_workers = max_workers or self._max_workers
+        errors = []
+        deleted = 0
+
+        def delete_batch(batch):
+            try:
+                response = self._cos_cli.delete_objects(
+                    Bucket=bucket_name,
+                    Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True})
+            except Exception as e:
+                return len(batch), [{"Key": key, "Code": type(e).__name__, "Message": str(e)} for key in batch]
+            failed = [{"Key": error.get("Key"), "Code": error.get("Code"), "Message": error.get("Message")} for error in response.get("Errors", [])]
+            return len(batch), failed
+
+        def collect(futures):
+            nonlocal deleted
+            for future in futures:
+                count, failed = future.result()
+                deleted += count - len(failed)
+                errors.extend(failed)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = set()
+            while True:
+                batch = list(itertools.islice(keys, DELETE_BATCH_SIZE))
+                if not batch:
+                    break
+                pending.add(executor.submit(delete_batch, batch))
+                # keep at most two batches per worker in flight so listing does
+                # not run arbitrarily far ahead of the deletes
+                if len(pending) >= max_workers * 2:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(finished)
+            collect(pending)
+
+        logger.info("Deleted %s items, %s failed", deleted, len(errors))
+        return errors
+
+    def delete_bucket(self, bucket_name, empty_bucket: bool=False):
         """
             Delete target bucket
             Parameters:
-                bucket_name:  <str>
-                              name of target bucket
+                bucket_name:   <str>
+                               name of target bucket
+                empty_bucket:  <bool>
+                               delete every file of the bucket first, buckets that
+                               still hold files can not be deleted
         """    
-        print(f"Creating new bucket: {bucket_name}")
+        logger.info("Deleting bucket: %s", bucket_name)
         try:
+            if empty_bucket:
+                errors = self.delete_many(bucket_name, prefix="")
+                if errors:
+                    raise RuntimeError(f"Unable to empty bucket, {len(errors)} items could not be deleted")
             self._cos_re.Bucket(bucket_name).delete()
-            print(f"Bucket: {bucket_name} delete.")
+            logger.info("Bucket: %s delete.", bucket_name)
         except ClientError as e:
-            print(f"CLIENT ERROR: {e}")
+            logger.error("CLIENT ERROR: %s", e)
             raise
         except Exception as e:
-            print(f"Unable to delete bucket: {e}")
+            logger.error("Unable to delete bucket: %s", e)
             raise
 
-    def create_text_file(self, bucket_name, item_name, file_text):
-        print("Creating new item: {0}".format(item_name))
+    def create_text_file(self, bucket_name, item_name, file_text, compression: str=None):
+        """
+            Creates target file from text, compressed with gzip / zstd when
+            compression is given or the item name has a .gz / .zst suffix
+        """
+        logger.info("Creating new item: %s", item_name)
         try:
-            self._cos_re.Object(bucket_name, item_name).put(Body=file_text)
-            print("Item: {0} created!".format(item_name))
+            codec = _codec(item_name, compression=compression)
+            if codec:
+                body, metadata = _encode_upload(file_text, codec)
+                self._cos_re.Object(bucket_name, item_name).put(Body=body, Metadata=metadata)
+            else:
+                self._cos_re.Object(bucket_name, item_name).put(Body=file_text)
+            logger.info("Item: %s created!", item_name)
         except ClientError as be:
-            print("CLIENT ERROR: {0}\n".format(be))
+            logger.error("CLIENT ERROR: %s", be)
+            record_error(be)
             # raise
         except Exception as e:
-            print("Unable to create text file: {0}".format(e))
+            logger.error("Unable to create text file: %s", e)
+            record_error(e)
             # raise
 
 if __name__ == '__main__':
@@ -0,0 +1,396 @@
+# Metrics and tracing of SQL, COS and NoSQL calls
+import sys
+import time
+import bisect
+import weakref
+import inspect
+import itertools
+import threading
+import functools
+
+from collections import deque, namedtuple
+
+# upper bounds in seconds of the call latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# one instrumented call, handed to every span sink
+Span = namedtuple("Span", ["name", "start_time", "end_time", "attributes", "error"])
+
+class Histogram():
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """
+            Cumulative histogram with fixed bucket upper bounds
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self):
+        """
+            Response:
+                histogram:  <dict>
+                            count, sum and cumulative count per bucket upper bound
+        """
+        cumulative = list(itertools.accumulate(self.counts))
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "buckets": dict(zip(self.buckets + (float("inf"),), cumulative)),
+        }
+
+class MetricsRegistry():
+
+    def __init__(self):
+        """
+            In-memory registry of counters, latency histograms and collectors.
+
+            Counters and histograms are keyed by name and labels. Collectors are
+            callables returning a dict of numbers, e.g. SQL.pool_stats, read when
+            a snapshot is taken. Span sinks get a Span per instrumented call, no
+            span is built while no sink is registered.
+        """
+        self.enabled = True
+        self._counters = {}
+        self._histograms = {}
+        self._collectors = {}
+        self._collector_ids = itertools.count()
+        self._sinks = []
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float=1, **labels):
+        """
+            Adds value to a counter
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        """
+            Records value in a latency histogram
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def record_call(self, labels: tuple, elapsed: float, rows: int, error: Exception=None):
+        """
+            Records one call of an instrumented method under a single lock,
+            labels is the sorted tuple of (component, method) label pairs
+        """
+        with self._lock:
+            key = ("calls_total", labels)
+            self._counters[key] = self._counters.get(key, 0) + 1
+            histogram = self._histograms.get(("latency_seconds", labels))
+            if histogram is None:
+                histogram = self._histograms[("latency_seconds", labels)] = Histogram()
+            histogram.observe(elapsed)
+            if rows:
+                key = ("rows_total", labels)
+                self._counters[key] = self._counters.get(key, 0) + rows
+        if error is not None:
+            self.inc("errors_total", error=type(error).__name__, **dict(labels))
+
+    def register_collector(self, name: str, collect, **labels):
+        """
+            Registers a callable returning a dict of gauges read on every
+            snapshot, exported as <name>_<key>. Bound methods are held weakly so
+            the registry does not keep their instance alive.
+
+            Response:
+                collector_id:  <int>
+                               id passed to unregister_collector
+        """
+        if inspect.ismethod(collect):
+            collect = weakref.WeakMethod(collect)
+        else:
+            collect = (lambda func: lambda: func)(collect)
+
+        collector_id = next(self._collector_ids)
+        with self._lock:
+            self._collectors[collector_id] = (name, tuple(sorted(labels.items())), collect)
+        return collector_id
+
+    def unregister_collector(self, collector_id: int):
+        with self._lock:
+            self._collectors.pop(collector_id, None)
+
+    def add_sink(self, sink):
+        """
+            Registers a span sink, a callable receiving a Span per call
+        """
+        with self._lock:
+            self._sinks = self._sinks + [sink]
+
+    def remove_sink(self, sink):
+        with self._lock:
+            self._sinks = [s for s in self._sinks if s is not sink]
+
+    def emit(self, span: Span):
+        for sink in self._sinks:
+            try:
+                sink(span)
+            except Exception:
+                pass
+
+    def snapshot(self):
+        """
+            Retrieves the current value of every metric
+
+            Response:
+                snapshot:  <dict>
+                           counters:   {(name, labels): value}
+                           histograms: {(name, labels): Histogram.snapshot()}
+                           gauges:     {(name, labels): value} read from collectors
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: histogram.snapshot() for key, histogram in self._histograms.items()}
+            collectors = list(self._collectors.items())
+
+        gauges = {}
+        for collector_id, (name, labels, collect) in collectors:
+            func = collect()
+            if func is None:
+                self.unregister_collector(collector_id)
+                continue
+            try:
+                values = func()
+            except Exception:
+                continue
+            for key, value in values.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    gauges[(f"{name}_{key}", labels)] = value
+        return {"counters": counters, "histograms": histograms, "gauges": gauges}
+
+    def to_prometheus(self, namespace: str="ro_database"):
+        """
+            Renders every metric in the Prometheus text exposition format
+        """
+        snapshot = self.snapshot()
+        lines = []
+
+        def render(name, labels, value, extra=()):
+            pairs = ",".join(f'{k}="{v}"' for k, v in tuple(labels) + tuple(extra))
+            return f"{name}{{{pairs}}} {value}" if pairs else f"{name} {value}"
+
+        def by_name(items):
+            grouped = {}
+            for (name, labels), value in sorted(items, key=lambda item: item[0]):
+                grouped.setdefault(f"{namespace}_{name}", []).append((labels, value))
+            return grouped.items()
+
+        for name, series in by_name(snapshot["counters"].items()):
+            lines.append(f"# TYPE {name} counter")
+            lines.extend(render(name, labels, value) for labels, value in series)
+
+        for name, series in by_name(snapshot["gauges"].items()):
+            lines.append(f"# TYPE {name} gauge")
+            lines.extend(render(name, labels, value) for labels, value in series)
+
+        for name, series in by_name(snapshot["histograms"].items()):
+            lines.append(f"# TYPE {name} histogram")
+            for labels, histogram in series:
+                for bound, count in histogram["buckets"].items():
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(render(f"{name}_bucket", labels, count, (("le", le),)))
+                lines.append(render(f"{name}_sum", labels, histogram["sum"]))
+                lines.append(render(f"{name}_count", labels, histogram["count"]))
+
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        """
+            Drops every counter and histogram, collectors and sinks are kept
+        """
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+class SpanRecorder():
+
+    def __init__(self, max_spans: int=10000):
+        """
+            Span sink keeping the last max_spans spans in memory
+        """
+        self.spans = deque(maxlen=max_spans)
+
+    def __call__(self, span: Span):
+        self.spans.append(span)
+
+class OpenTelemetrySink():
+
+    def __init__(self, tracer=None):
+        """
+            Span sink forwarding spans to an OpenTelemetry tracer, the global
+            tracer provider's tracer when None. Requires opentelemetry-api.
+        """
+        from opentelemetry import trace
+
+        self._trace = trace
+        self._tracer = tracer or trace.get_tracer("ro_database")
+
+    def __call__(self, span: Span):
+        otel_span = self._tracer.start_span(span.name, start_time=int(span.start_time * 1e9), attributes=span.attributes)
+        if span.error is not None:
+            otel_span.record_exception(span.error)
+            otel_span.set_status(self._trace.Status(self._trace.StatusCode.ERROR))
+        otel_span.end(end_time=int(span.end_time * 1e9))
+
+def _shared_registry():
+    # the module is loaded both as py_metrics by the backends and as a package
+    # submodule by the package namespace, every copy shares the first registry
+    for name, module in list(sys.modules.items()):
+        registry = getattr(module, "REGISTRY", None) if name.split(".")[-1] == "py_metrics" else None
+        if registry is not None:
+            return registry
+    return MetricsRegistry()
+
+# registry every instrumented class reports to
+REGISTRY = _shared_registry()
+
+_active = threading.local()
+
+def set_enabled(enabled: bool):
+    """
+        Turns instrumentation on or off, disabled calls skip every measurement
+    """
+    REGISTRY.enabled = enabled
+
+def record_error(error: Exception, component: str="", method: str=""):
+    """
+        Records an error handled inside an instrumented call, so methods that
+        report failures without raising still count them and fail their span.
+        Outside of an instrumented call, e.g. on a worker thread, the error is
+        counted under component and method.
+    """
+    calls = getattr(_active, "calls", None)
+    if calls:
+        calls[-1]["error"] = error
+    elif REGISTRY.enabled:
+        REGISTRY.inc("errors_total", component=component, method=method, error=type(error).__name__)
+
+def record_bytes(component: str, direction: str, nbytes: int):
+    """
+        Adds nbytes to the bytes moved by a component, direction is read or write
+    """
+    if REGISTRY.enabled:
+        REGISTRY.inc("bytes_total", nbytes, component=component, direction=direction)
+
+def _rows(value):
+    # only dataframes are counted, they expose their row count without a scan
+    if hasattr(value, "columns") and hasattr(value, "__len__"):
+        return len(value)
+    return 0
+
+class _Call():
+
+    __slots__ = ("labels", "start", "wall", "state")
+
+    def __init__(self, labels):
+        self.labels = labels
+        self.state = {"error": None}
+        self.start = time.perf_counter()
+        self.wall = time.time()
+
+    def enter(self):
+        calls = getattr(_active, "calls", None)
+        if calls is None:
+            calls = _active.calls = []
+        calls.append(self.state)
+
+    def exit(self):
+        _active.calls.pop()
+
+    def finish(self, rows, error=None):
+        error = error or self.state["error"]
+        elapsed = time.perf_counter() - self.start
+        REGISTRY.record_call(self.labels, elapsed, rows, error)
+
+        if REGISTRY._sinks:
+            attributes = dict(self.labels, rows=rows)
+            REGISTRY.emit(Span("{component}.{method}".format(**attributes), self.wall, self.wall + elapsed, attributes, error))
+
+def instrument(component: str, method: str=None):
+    """
+        Decorator recording calls, latency, rows and errors of a function.
+
+        Rows are counted from a dataframe returned, a dataframe passed as first
+        argument, or every dataframe yielded by a generator function, whose
+        latency runs until the generator is exhausted or closed.
+    """
+    def decorator(func):
+        labels = (("component", component), ("method", method or func.__name__))
+
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def generator(*args, **kwargs):
+                if not REGISTRY.enabled:
+                    yield from func(*args, **kwargs)
+                    return
+
+                call = _Call(labels)
+                rows = 0
+                error = None
+                iterator = func(*args, **kwargs)
+                try:
+                    while True:
+                        call.enter()
+                        try:
+                            value = next(iterator)
+                        except StopIteration:
+                            return
+                        finally:
+                            call.exit()
+                        rows += _rows(value)
+                        yield value
+                except BaseException as e:
+                    if not isinstance(e, GeneratorExit):
+                        error = e
+                    raise
+                finally:
+                    iterator.close()
+                    call.finish(rows, error)
+            return generator
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not REGISTRY.enabled:
+                return func(*args, **kwargs)
+
+            call = _Call(labels)
+            call.enter()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                call.exit()
+                call.finish(0, e)
+                raise
+            call.exit()
+            call.finish(_rows(result) or (_rows(args[1]) if len(args) > 1 else 0))
+            return result
+        return wrapper
+    return decorator
+
+def instrumented(component: str, exclude: tuple=()):
+    """
+        Class decorator instrumenting every public method of the class not
+        listed in exclude, see instrument
+    """
+    def decorator(cls):
+        for name, attribute in list(vars(cls).items()):
+            if name.startswith("_") or name in exclude or not inspect.isfunction(attribute):
+                continue
+            setattr(cls, name, instrument(component, name)(attribute))
+        return cls
+    return decorator
@@ -1,101 +1,387 @@
 # Mongo-DB Library imports
-import os
-import json
-import pymongo
+import time
+import bson
+import logging
+import threading
+import pandas as pd
 
 from utils import *
-from pymongo import MongoClient
+from py_metrics import REGISTRY, instrument, instrumented
+from pymongo import MongoClient, InsertOne, UpdateOne
+from pymongo.errors import CollectionInvalid
 
+logger = logging.getLogger(__name__)
+
+@instrumented("nosql", exclude=("get_database", "bulk_writer", "close"))
 class NoSQL():
 
-    def __init__(self):
+    def __init__(self, db_name: str=None, tls: bool=True):
         """
             Initializes NoSQL class and retrieves associated credentials
+
+            Parameters:
+                db_name: <str>
+                         database used when a method gets no db_name,
+                         defaults to the database of the connection string
+                tls:     <bool>
+                         connect over TLS verified with ./tmpCert.crt, disable
+                         for local servers without TLS
         """
 
-        if 'VCAP_SERVICES' in os.environ:
-            vcap = json.loads(os.getenv('VCAP_SERVICES'))
-            print('Found VCAP_SERVICES')
-
-            if 'databases-for-mongodb' in vcap:
-                mongoCreds = vcap["databases-for-mongodb"][0]["credentials"]
-                mongo_composed = mongoCreds["connection"]["mongodb"]["composed"][0]
-            else:
-                raise MissingCreds("NoSQL creds not fouund in OS Environment!")
-        elif os.path.isfile('vcap_services.json'):
-            with open('vcap_services.json') as f:
-                vcap = json.load(f)
-                print('Found local VCAP_SERVICES')
-
-            if 'databases-for-mongodb' in vcap:
-                mongoCreds = vcap["databases-for-mongodb"][0]["credentials"]
-                mongo_composed = mongoCreds["connection"]["mongodb"]["composed"][0]
-            else:
-                raise MissingCreds("NoSQL creds not found in OS Environment!")
-        else:
-            raise MissingCreds("VCAP_SERVICES Not found in OS Environment!") 
+        mongoCreds = get_service_credentials('databases-for-mongodb')
+        mongo_composed = mongoCreds["connection"]["mongodb"]["composed"][0]
 
-        self._mongo_cli = MongoClient(
-            mongo_composed,
-            ssl = True,
-            ssl_ca_certs = "./tmpCert.crt")
+        if tls:
+            self._mongo_cli = MongoClient(
+                mongo_composed,
+                ssl = True,
+                ssl_ca_certs = "./tmpCert.crt")
+        else:
+            self._mongo_cli = MongoClient(mongo_composed)
+        self._db_name = db_name
+        self._collections = set()
+        self._collections_lock = threading.Lock()
+        self._sequences = {}
 
-    def get_database(self, db_name):
+    def get_database(self, db_name: str=None):
         """
             Retrieves mongodb object for specified database name
 
             Parameters:
                 db_name: <str>
-                        name of target database
+                        name of target database, the default database when None
         """
-        db = self._mongo_cli.get_database(db_name)
-        return db
+        if db_name or self._db_name:
+            return self._mongo_cli.get_database(db_name or self._db_name)
+        return self._mongo_cli.get_default_database()
 
-    def update_collection(self, col_name, document):
+    def update_collection(self, col_name, document, db_name: str=None):
         """
             Updates target database collection for target database
 
             1. Retrieves mongodb object
-            2. Retrieve list of avaliable collections in target db
-            3. If collection exists retrieve target collection, else create a new one 
-               and retrieve it
-            4. If document exists update it, else create new document
+            2. If collection is not known to exist yet, create it
+            3. Insert document in the collection
 
-            arameters:
-                db_name: <str>
-                         name of target database
+            Many documents are written faster with bulk_writer.
 
+            Parameters:
                 col_name: <str>
                           name of targeet mongodb collection
 
-                document: <list>
-                          list of documents retrieved from target collection
+                document: <dict>
+                          document to insert
+
+                db_name: <str>
+                         name of target database, the default database when None
         """
-        # Get database
-        db = self._mongo_cli.get_database(db_name)
+        collection = self._get_collection(col_name, db_name)
+        collection.insert_one(document)
 
-        # Check if collection exists
-        collection_names = db.list_collection_names()
+    def read(self, col_name: str, filter: dict=None, projection=None, batch_size: int=10000, db_name: str=None):
+        """
+            Streams the documents of a collection as dataframes
 
-        if col_name not in collection_names:
-            # Create collection
-            db.create_collection(col_name)
+            Documents are fetched in raw BSON batches with the projection applied
+            by the server. Every batch is decoded with bson.decode_all, pivoted
+            into column lists and yielded as one dataframe, so memory stays
+            bounded by batch_size instead of the whole cursor.
+            The columns of a dataframe are the fields present in its batch, fields
+            missing from a document are None, nested documents and arrays are
+            kept as python objects.
 
-        collection = db.get_collection(col_name)
-        collection.insert_one(document)
+            Parameters:
+                col_name:   <str>
+                            name of target collection
+                filter:     <dict>
+                            query filter, every document when None
+                projection: <list | dict>
+                            fields to return, every field when None
+                batch_size: <int>
+                            documents per dataframe
+                db_name:    <str>
+                            name of target database, the default database when None
+            Response:
+                chunks:     <generator of pandas dataframe>
+        """
+        if isinstance(projection, (list, tuple)):
+            projection = {field: 1 for field in projection}
+
+        collection = self.get_database(db_name).get_collection(col_name)
+        cursor = collection.find_raw_batches(filter or {}, projection, batch_size=batch_size)
+        try:
+            for batch in cursor:
+                documents = bson.decode_all(batch)
+                if documents:
+                    yield pd.DataFrame(self._columns(documents))
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def _columns(documents):
+        columns = {}
+        for i, document in enumerate(documents):
+            for field, value in document.items():
+                column = columns.get(field)
+                if column is None:
+                    column = columns[field] = [None] * i
+                column.append(value)
+            for column in columns.values():
+                if len(column) <= i:
+                    column.append(None)
+        return columns
+
+    def bulk_writer(self, db_name: str=None, max_docs: int=1000, max_bytes: int=1024 * 1024 * 8, flush_interval: float=1.0):
+        """
+            Retrieves a BulkWriter buffering documents written to this database
+
+            Parameters:
+                db_name:         <str>
+                                 name of target database, the default database when None
+                max_docs:        <int>
+                                 buffered documents of a collection that trigger a flush
+                max_bytes:       <int>
+                                 buffered BSON bytes of a collection that trigger a flush
+                flush_interval:  <float>
+                                 seconds after which buffered documents are flushed
+            Response:
+                writer:          <BulkWriter>
+        """
+        return BulkWriter(self, db_name, max_docs, max_bytes, flush_interval)
+
+    def close(self):
+        """
+            Closes the mongo client
+        """
+        self._mongo_cli.close()
+
+    def _get_collection(self, col_name, db_name=None):
+        """
+            Retrieves a collection, creating it on first use. Collections known
+            to exist are remembered so later writes skip listing the database.
+        """
+        db = self.get_database(db_name)
+        if (db.name, col_name) not in self._collections:
+            if col_name not in db.list_collection_names():
+                try:
+                    db.create_collection(col_name)
+                except CollectionInvalid:
+                    # created concurrently by another writer
+                    pass
+            with self._collections_lock:
+                self._collections.add((db.name, col_name))
+        return db.get_collection(col_name)
+
+    def get_sequence(self, name: str="unique_ids", db_name: str=None):
+        """
+            Retrieves the next value of a named sequence
+
+            Values are reserved from the sequence collection in blocks by a
+            SequenceAllocator shared by every caller of this instance, so most
+            calls are served locally. Values are unique and increasing within a
+            process but not gapless, see SequenceAllocator.
+
+            Parameters:
+                name:    <str>
+                         name of the sequence
+                db_name: <str>
+                         name of target database, the default database when None
+        """
+        db = self.get_database(db_name)
+        with self._collections_lock:
+            allocator = self._sequences.get((db.name, name))
+            if allocator is None:
+                allocator = SequenceAllocator(self, name, db_name)
+                self._sequences[(db.name, name)] = allocator
+        return allocator.next()
 
-    def get_sequence(self):
+class SequenceAllocator():
+
+    def __init__(self, nosql: NoSQL, name: str="unique_ids", db_name: str=None, min_block: int=1, max_block: int=10000, target_interval: float=1.0):
+        """
+            Hands out values of a named sequence from blocks reserved with a
+            single $inc on the sequence collection (hi/lo allocation).
+
+            The block size adapts to consumption: it doubles when a block lasted
+            less than target_interval and halves when it lasted more than four
+            times as long, so idle sequences waste few values and busy ones
+            need few round trips. Values left in a block when the process exits
+            are never issued, sequences have gaps but no duplicates.
+
+            Parameters:
+                nosql:            <NoSQL>
+                                  client the blocks are reserved with
+                name:             <str>
+                                  name of the sequence
+                db_name:          <str>
+                                  name of target database, the default database when None
+                min_block:        <int>
+                                  smallest block reserved
+                max_block:        <int>
+                                  largest block reserved
+                target_interval:  <float>
+                                  seconds a block should last
+        """
+        self._nosql = nosql
+        self._name = name
+        self._db_name = db_name
+        self._min_block = min_block
+        self._max_block = max_block
+        self._target_interval = target_interval
+        self._block = min_block
+        self._next = 0
+        self._hi = 0
+        self._reserved_at = None
+        self._lock = threading.Lock()
+
+    def next(self):
+        """
+            Retrieves the next value of the sequence
+        """
+        with self._lock:
+            if self._next >= self._hi:
+                self._reserve()
+            value = self._next
+            self._next += 1
+        return value
+
+    def _reserve(self):
+        now = time.monotonic()
+        if self._reserved_at is not None:
+            elapsed = now - self._reserved_at
+            if elapsed < self._target_interval:
+                self._block = min(self._block * 2, self._max_block)
+            elif elapsed > self._target_interval * 4:
+                self._block = max(self._block // 2, self._min_block)
+        self._reserved_at = now
+
+        db = self._nosql.get_database(self._db_name)
+        document = db.sequences.find_one_and_update({"_id": self._name}, {"$inc": {"value": self._block}}, upsert=True, return_document=True)
+        # the stored value is the last value handed out by any allocator
+        self._hi = document["value"] + 1
+        self._next = self._hi - self._block
+
+class BulkWriter():
+
+    def __init__(self, nosql: NoSQL, db_name: str=None, max_docs: int=1000, max_bytes: int=1024 * 1024 * 8, flush_interval: float=1.0):
         """
-            Retrieves last updated value in the sequence collection
+            Buffers documents per collection and writes them with unordered
+            insert_many / bulk_write, so one round trip carries a whole batch.
+
+            A collection is flushed once it buffers max_docs documents or
+            max_bytes of BSON, and a background thread flushes collections whose
+            oldest buffered document is older than flush_interval. Use as a
+            context manager or call close() so the last documents are written.
+            Errors of background flushes are raised by the next call.
 
             Parameters:
-                        db_name: <str>
-                        name of target database
+                nosql:           <NoSQL>
+                                 client the documents are written with
+                db_name:         <str>
+                                 name of target database, the default database when None
+                max_docs:        <int>
+                                 buffered documents of a collection that trigger a flush
+                max_bytes:       <int>
+                                 buffered BSON bytes of a collection that trigger a flush
+                flush_interval:  <float>
+                                 seconds after which buffered documents are flushed,
+                                 no background flushes when None
+        """
+        self._nosql = nosql
+        self._db_name = db_name
+        self._max_docs = max_docs
+        self._max_bytes = max_bytes
+        self._flush_interval = flush_interval
+        self._buffers = {}
+        self._lock = threading.Lock()
+        self._error = None
+        self._closed = threading.Event()
+        self._thread = None
+
+        if flush_interval:
+            self._thread = threading.Thread(target=self._flush_loop, daemon=True)
+            self._thread.start()
+
+    def insert(self, col_name: str, document: dict):
+        """
+            Buffers a document to insert in target collection
         """
-        db = self.get_database()
-        document = db.sequences.find_one_and_update({"_id": "unique_ids"}, {"$inc": {"value": 1}}, upsert=True, return_document=True)
-        id = document["value"]
-        return id
+        self._add(col_name, document, document)
+
+    def upsert(self, col_name: str, filter: dict, document: dict):
+        """
+            Buffers an update setting the fields of document on the document
+            matching filter, inserted when no document matches
+        """
+        self._add(col_name, UpdateOne(filter, {"$set": document}, upsert=True), document)
+
+    def flush(self, col_name: str=None):
+        """
+            Writes the buffered documents of one collection, or of every
+            collection when col_name is None
+        """
+        with self._lock:
+            names = [col_name] if col_name else list(self._buffers)
+            batches = [(name, self._buffers.pop(name)) for name in names if name in self._buffers]
+
+        for name, (_, _, operations) in batches:
+            self._write(name, operations)
+        self._raise_error()
+
+    def close(self):
+        """
+            Stops the background flushes and writes the buffered documents
+        """
+        self._closed.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _add(self, col_name, operation, document):
+        self._raise_error()
+        size = len(bson.encode(document))
+        with self._lock:
+            started, nbytes, operations = self._buffers.setdefault(col_name, (time.monotonic(), 0, []))
+            operations.append(operation)
+            self._buffers[col_name] = (started, nbytes + size, operations)
+            full = len(operations) >= self._max_docs or nbytes + size >= self._max_bytes
+        if full:
+            self.flush(col_name)
+
+    @instrument("nosql", "bulk_write")
+    def _write(self, col_name, operations):
+        # inserts are buffered as plain documents, upserts as UpdateOne
+        collection = self._nosql._get_collection(col_name, self._db_name)
+        if all(isinstance(operation, dict) for operation in operations):
+            collection.insert_many(operations, ordered=False)
+        else:
+            collection.bulk_write([InsertOne(operation) if isinstance(operation, dict) else operation for operation in operations], ordered=False)
+        if REGISTRY.enabled:
+            REGISTRY.inc("rows_total", len(operations), component="nosql", method="bulk_write")
+
+    def _flush_loop(self):
+        while not self._closed.wait(self._flush_interval / 2):
+            now = time.monotonic()
+            with self._lock:
+                stale = [name for name, (started, _, _) in self._buffers.items() if now - started >= self._flush_interval]
+            for name in stale:
+                try:
+                    self.flush(name)
+                except Exception as e:
+                    logger.error("Unable to flush documents to collection %s: %s", name, e)
+                    self._error = e
+
+    def _raise_error(self):
+        error, self._error = self._error, None
+        if error is not None:
+            raise error
 
 if __name__ == '__main__':
     py_nosql = NoSQL()
@@ -0,0 +1,156 @@
+# Parameterized SELECT statement builder
+import hashlib
+
+class Query():
+
+    # operator -> sql template, {col} is the column and {p} a bind parameter
+    OPERATORS = {
+        "=": "{col} = {p}",
+        "!=": "{col} <> {p}",
+        "<>": "{col} <> {p}",
+        "<": "{col} < {p}",
+        "<=": "{col} <= {p}",
+        ">": "{col} > {p}",
+        ">=": "{col} >= {p}",
+        "like": "{col} LIKE {p}",
+        "in": "{col} = ANY({p})",
+        "not in": "{col} <> ALL({p})",
+        "between": "{col} BETWEEN {p} AND {p}",
+        "is null": "{col} IS NULL",
+        "is not null": "{col} IS NOT NULL",
+    }
+
+    def __init__(self, table_name: str, schema: str, columns: list=None):
+        """
+            Builds a SELECT statement whose values are sent as bind parameters.
+
+            Statements only differ in their parameters for calls with the same
+            shape (columns, operators, ordering), so a statement prepared once on
+            the server can be reused for every call of that shape.
+
+            Parameters:
+                table_name: <str>
+                            sql table name
+                schema:     <str>
+                            sql schema name
+                columns:    <list>
+                            columns to retrieve, all columns when None
+        """
+        self.table_name = table_name
+        self.schema = schema
+        self.columns = list(columns) if columns else None
+        self._groups = []
+        self._order_by = []
+        self._limit = None
+
+    def where(self, *conditions, conjunction: str="AND"):
+        """
+            Adds a group of conditions, groups are combined with AND
+
+            Parameters:
+                conditions:   <tuple>
+                              (column, value) for equality or (column, operator, value)
+                              where operator is one of Query.OPERATORS. in/not in take
+                              a list, between takes a (low, high) pair
+                conjunction:  <str>
+                              AND / OR, operator joining the conditions of the group
+        """
+        group = []
+        for condition in conditions:
+            if len(condition) == 2:
+                column, value = condition
+                op = "="
+            else:
+                column, op, value = condition
+            op = op.lower()
+            if value is None and op in ("=", "!=", "<>"):
+                op = "is null" if op == "=" else "is not null"
+            if op not in self.OPERATORS:
+                raise ValueError(f"Unsupported operator: {op}")
+            if op in ("in", "not in"):
+                value = list(value)
+            group.append((column, op, value))
+
+        if conjunction.upper() not in ("AND", "OR"):
+            raise ValueError(f"Unsupported conjunction: {conjunction}")
+        if group:
+            self._groups.append((conjunction.upper(), group))
+        return self
+
+    def order_by(self, *columns):
+        """
+            Sets the ORDER BY columns, e.g. "date" or "date DESC"
+        """
+        self._order_by.extend(columns)
+        return self
+
+    def limit(self, limit: int):
+        """
+            Sets the maximum number of rows returned
+        """
+        self._limit = limit
+        return self
+
+    @property
+    def tables(self):
+        return [f"{self.schema}.{self.table_name}"]
+
+    def compile(self, style: str="pyformat"):
+        """
+            Compiles the statement
+
+            Parameters:
+                style:  <str>
+                        pyformat for psycopg2 (%s) or numeric for server side
+                        PREPARE and asyncpg ($1, $2, ...)
+
+            Response:
+                sql:     <str>
+                         statement text
+                params:  <list>
+                         bind parameters in placeholder order
+        """
+        params = []
+
+        def placeholder():
+            return "%s" if style == "pyformat" else f"${len(params)}"
+
+        clauses = []
+        for conjunction, group in self._groups:
+            conditions = []
+            for column, op, value in group:
+                template = self.OPERATORS[op]
+                if op == "between":
+                    low, high = value
+                    params.append(low)
+                    low = placeholder()
+                    params.append(high)
+                    high = placeholder()
+                    conditions.append(f"{column} BETWEEN {low} AND {high}")
+                elif "{p}" in template:
+                    params.append(value)
+                    conditions.append(template.format(col=column, p=placeholder()))
+                else:
+                    conditions.append(template.format(col=column))
+            clauses.append("(" + f" {conjunction} ".join(conditions) + ")")
+
+        columns = ",".join(self.columns) if self.columns else "*"
+        sql = f"SELECT {columns} FROM {self.schema}.{self.table_name}"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        if self._order_by:
+            sql += " ORDER BY " + ", ".join(self._order_by)
+        if self._limit is not None:
+            params.append(self._limit)
+            sql += f" LIMIT {placeholder()}"
+        return sql, params
+
+    def statement_name(self):
+        """
+            Name of the server side prepared statement for this query shape
+        """
+        sql, _ = self.compile(style="numeric")
+        return "ro_" + hashlib.md5(sql.encode()).hexdigest()[:16]
+
+    def __repr__(self):
+        return "Query({0!r}, {1!r})".format(*self.compile())
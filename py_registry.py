@@ -0,0 +1,76 @@
+# Process-wide registry of shared SQL, COS and NoSQL clients
+import os
+import threading
+import importlib
+
+_CLIENTS = {
+    "sql": ("py_sql", "SQL"),
+    "cos": ("py_cos", "COS"),
+    "nosql": ("py_nosql", "NoSQL"),
+}
+
+_clients = {}
+_lock = threading.Lock()
+_pid = os.getpid()
+
+def get_client(kind: str, **kwargs):
+    """
+        Retrieves the shared client of a kind, created on first use
+
+        Clients are shared by every caller asking for the same kind and
+        arguments, so engines, pools and boto / mongo clients are built once
+        per process. After a fork the child starts with an empty registry and
+        builds its own clients, sockets inherited from the parent are not reused.
+
+        Parameters:
+            kind:    <str>
+                     sql, cos or nosql
+            kwargs:  arguments passed to the client constructor
+        Response:
+            client:  <SQL | COS | NoSQL>
+    """
+    if kind not in _CLIENTS:
+        raise ValueError(f"Unknown client kind: {kind}")
+
+    key = (kind, repr(sorted(kwargs.items())))
+    with _lock:
+        _check_pid()
+        client = _clients.get(key)
+        if client is None:
+            module_name, class_name = _CLIENTS[kind]
+            module = importlib.import_module(module_name)
+            client = getattr(module, class_name)(**kwargs)
+            _clients[key] = client
+        return client
+
+def clear_clients():
+    """
+        Closes and drops every shared client
+    """
+    with _lock:
+        clients = list(_clients.values())
+        _clients.clear()
+
+    for client in clients:
+        close = getattr(client, "close", None)
+        if close is not None:
+            close()
+
+def _check_pid():
+    if _pid != os.getpid():
+        _after_fork()
+
+def _after_fork():
+    global _pid, _lock
+
+    # the parent owns the inherited connections, the child must not close them
+    for client in _clients.values():
+        engine = getattr(client, "_alchemy_engine", None)
+        if engine is not None:
+            engine.dispose(close=False)
+    _clients.clear()
+    _lock = threading.Lock()
+    _pid = os.getpid()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
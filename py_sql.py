@@ -1,52 +1,93 @@
 # PostgreSQL & SQL Alchemy Library imports
+import io
 import os
 import json
+import time
+import logging
+import datetime
+import tempfile
+import threading
 import psycopg2
+import psycopg2.extras
+import psycopg2.errors
+import numpy as np
 import pandas as pd
 
 from utils import *
-from sqlalchemy import create_engine
-
+from py_query import Query
+from py_cache import ResultCache
+from py_metrics import REGISTRY, instrumented, record_bytes
+from contextlib import contextmanager
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import create_engine, event
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = None
+
+# frames with at least this many rows are written through COPY by SQL.update
+BULK_UPDATE_ROWS = 50000
+
+# prepared statements kept per pooled connection, least recently used first out
+MAX_PREPARED_STATEMENTS = 256
+
+# COPY TO STDOUT output is kept in memory up to this size, then spooled to disk
+COPY_SPOOL_BYTES = 1024 * 1024 * 256
+
+# postgres type oids used to map COPY csv output onto pandas dtypes
+BOOL_OIDS = {16}
+INT_OIDS = {20, 21, 23}
+FLOAT_OIDS = {700, 701}
+TEXT_OIDS = {18, 19, 25, 1042, 1043, 2950}
+JSON_OIDS = {114, 3802}
+TIMESTAMPTZ_OIDS = {1184}
+DATE_OIDS = {1082, 1114, 1184}
+DAY_OIDS = {1082}
+
+# datetime64 units pandas gives python dates and datetimes, which read_sql_table
+# and the row by row paths produce, e.g. ns on pandas 2, s / us on pandas 3
+DAY_UNIT = np.datetime_data(pd.to_datetime([datetime.date(2000, 1, 1)]).dtype)[0]
+TIMESTAMP_UNIT = np.datetime_data(pd.to_datetime([datetime.datetime(2000, 1, 1)]).dtype)[0]
+
+logger = logging.getLogger(__name__)
+
+@instrumented("sql", exclude=("pool_stats", "close"))
 class SQL(): 
 
-    def __init__(self):
+    def __init__(self, pool_min_size: int=1, pool_max_size: int=10, pool_recycle: int=1800, pool_timeout: int=30, cache: ResultCache=None):
         """
             Initializes SQL class by creating a SQL managed resource pool and 
             retrieving pool credentials.
-        """
 
-        if 'VCAP_SERVICES' in os.environ:
-            vcap = json.loads(os.getenv('VCAP_SERVICES'))
+            The resource pool is shared by the raw psycopg2 paths (create, update)
+            and the SQL Alchemy paths (read), so every call reuses an already
+            authenticated connection instead of opening a new one.
 
-            # PostgreSQL database
-            if 'databases-for-postgresql' in vcap:
-                self._pgsqlCreds = vcap['databases-for-postgresql'][0]["credentials"]["connection"]["postgres"]
-                self._pgsqlHost = self._pgsqlCreds["hosts"][0]["hostname"]
-                self._pgsqlPort = self._pgsqlCreds["hosts"][0]["port"]
-                self._pgsqlUser = self._pgsqlCreds["authentication"]["username"]
-                self._pgsqlPass = self._pgsqlCreds["authentication"]["password"]
-                self._pgsqlDbname = self._pgsqlCreds["database"]
-                self._pgsqlAlcehmy = self._pgsqlCreds["composed"][0]
-            else:
-                raise MissingCreds("SQL creds not fouund in OS Environment!")
-        elif os.path.isfile('vcap_services.json'):
-            with open('vcap_services.json') as f:
-                vcap = json.load(f)
-                print('Found local VCAP_SERVICES')
-                
-            # PostgreSQL database
-            if 'databases-for-postgresql' in vcap:
-                self._pgsqlCreds = vcap['databases-for-postgresql'][0]["credentials"]["connection"]["postgres"]
-                self._pgsqlHost = self._pgsqlCreds["hosts"][0]["hostname"]
-                self._pgsqlPort = self._pgsqlCreds["hosts"][0]["port"]
-                self._pgsqlUser = self._pgsqlCreds["authentication"]["username"]
-                self._pgsqlPass = self._pgsqlCreds["authentication"]["password"]
-                self._pgsqlDbname = self._pgsqlCreds["database"]
-                self._pgsqlAlcehmy = self._pgsqlCreds["composed"][0]
-            else:
-                raise MissingCreds("VCAP_SERVICES Not found in OS Environment!")
-        else:
-            raise MissingCreds("VCAP_SERVICES Not found in OS Environment!")
+            Parameters:
+                pool_min_size:  <int>
+                                connections opened up front and kept idle in the pool
+                pool_max_size:  <int>
+                                upper bound of connections checked out at the same time
+                pool_recycle:   <int>
+                                seconds after which an idle connection is replaced
+                pool_timeout:   <int>
+                                seconds to wait for a free connection before failing
+                cache:          <ResultCache>
+                                optional cache of SQL.read results, invalidated by
+                                SQL.create and SQL.update on the same table
+        """
+
+        # PostgreSQL database
+        self._pgsqlCreds = get_service_credentials('databases-for-postgresql')["connection"]["postgres"]
+        self._pgsqlHost = self._pgsqlCreds["hosts"][0]["hostname"]
+        self._pgsqlPort = self._pgsqlCreds["hosts"][0]["port"]
+        self._pgsqlUser = self._pgsqlCreds["authentication"]["username"]
+        self._pgsqlPass = self._pgsqlCreds["authentication"]["password"]
+        self._pgsqlDbname = self._pgsqlCreds["database"]
+        self._pgsqlAlcehmy = self._pgsqlCreds["composed"][0]
 
         self._conn_string = "host="+self._pgsqlHost+ \
                             " port="+str(self._pgsqlPort)+ \
@@ -54,8 +95,114 @@ class SQL():
                             " user="+self._pgsqlUser+\
                             " password="+self._pgsqlPass
 
-        
-        self._alchemy_engine = create_engine(self._pgsqlAlcehmy, connect_args={'sslrootcert': os.getenv('POSTGRESQL_ROOT_CRT')})
+        if pool_max_size < pool_min_size:
+            raise ValueError("pool_max_size must be greater or equal to pool_min_size")
+
+        # Single pool for every connection handed out by this instance:
+        #   pool_size    -> connections kept open once created (min size)
+        #   max_overflow -> extra connections allowed under load (max size)
+        #   pool_pre_ping -> health check before a connection is handed out
+        #   pool_recycle -> idle connections older than this are reopened
+        self._alchemy_engine = create_engine(
+            self._pgsqlAlcehmy,
+            connect_args={'sslrootcert': os.getenv('POSTGRESQL_ROOT_CRT')},
+            pool_size=pool_min_size,
+            max_overflow=pool_max_size - pool_min_size,
+            pool_recycle=pool_recycle,
+            pool_timeout=pool_timeout,
+            pool_pre_ping=True)
+
+        self._pool_max_size = pool_max_size
+        self._cache = cache
+        self._pool_lock = threading.Lock()
+        self._pool_stats = {"checkouts": 0, "waits": 0, "wait_time": 0.0}
+
+        event.listen(self._alchemy_engine, "checkout", self._on_checkout)
+
+        REGISTRY.register_collector("sql_pool", self.pool_stats, instance=hex(id(self)))
+        if cache is not None:
+            REGISTRY.register_collector("sql_cache", cache.stats, instance=hex(id(cache)))
+
+        # warm up the pool so the first calls skip the connection handshake
+        warm = [self._alchemy_engine.raw_connection() for _ in range(pool_min_size)]
+        for connection in warm:
+            connection.close()
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self._pool_lock:
+            self._pool_stats["checkouts"] += 1
+
+    def _acquire(self, acquire):
+        """
+            Checks a connection out of the pool, recording whether the caller
+            had to wait for a connection to be returned
+        """
+        pool = self._alchemy_engine.pool
+        exhausted = pool.checkedout() >= self._pool_max_size
+        start = time.perf_counter()
+        connection = acquire()
+        waited = time.perf_counter() - start
+        if exhausted:
+            with self._pool_lock:
+                self._pool_stats["waits"] += 1
+                self._pool_stats["wait_time"] += waited
+        return connection
+
+    @contextmanager
+    def _raw_connection(self):
+        """
+            Yields a pooled psycopg2 connection, returned to the pool on exit
+        """
+        connection = self._acquire(self._alchemy_engine.raw_connection)
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+    @contextmanager
+    def _alchemy_connection(self):
+        """
+            Yields a pooled SQL Alchemy connection, returned to the pool on exit
+        """
+        connection = self._acquire(self._alchemy_engine.connect)
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+    def pool_stats(self):
+        """
+            Retrieves the resource pool statistics
+
+            Response:
+                stats:  <dict>
+                        size:        connections currently held open by the pool
+                        checked_out: connections currently in use
+                        idle:        connections waiting in the pool
+                        checkouts:   total number of connections handed out
+                        waits:       checkouts that had to wait for a free connection
+                        wait_time:   total seconds spent waiting on the pool
+        """
+        pool = self._alchemy_engine.pool
+        with self._pool_lock:
+            stats = dict(self._pool_stats)
+        stats["size"] = pool.checkedin() + pool.checkedout()
+        stats["checked_out"] = pool.checkedout()
+        stats["idle"] = pool.checkedin()
+        return stats
+
+    def _invalidate(self, table_name: str):
+        """
+            Drops cached results of a table that was just written
+        """
+        if self._cache is not None:
+            self._cache.invalidate(table_name)
+
+    def close(self):
+        """
+            Closes every pooled connection
+        """
+        self._alchemy_engine.dispose()
  
     def create(self, table_name: str, table_structure: list):
         """
@@ -74,71 +221,378 @@ class SQL():
         primary_key = table_structure[-1]
         table = ", ".join(table_structure[:-1])
         cmd = f"CREATE TABLE {table_name} ({table}, PRIMARY KEY ({primary_key}));"
-        try:
-            connection = psycopg2.connect(self._conn_string, sslrootcert="root.crt")
+        with self._raw_connection() as connection:
             cur = connection.cursor()
-            cur.execute(cmd)
-        except Exception as e:
-            print(e)
-            raise        
-        finally:
-            cur.close()
-            connection.close()
-
-    def read(self, table_name: str, schema: str, columns: list=None, conditionals: list=None, conditional_type: str=None, date_col: str=None, start_date: str=None, end_date: str=None):
+            try:
+                cur.execute(cmd)
+                connection.commit()
+                self._invalidate(table_name)
+            except Exception as e:
+                connection.rollback()
+                logger.error("Unable to create table %s: %s", table_name, e)
+                raise
+            finally:
+                cur.close()
+
+    def read(self, table_name: str, schema: str, columns: list=None, conditionals: list=None, conditional_type: str=None, date_col: str=None, start_date: str=None, end_date: str=None, order_by: list=None, limit: int=None, prepare: bool=True, partitions: int=None, partition_col: str=None, partition_range: tuple=None, max_concurrency: int=4, fast: bool=False, dtype_backend: str=None, use_cache: bool=True):
         """
             Retrieve the sql datatable to pandas dataframe
 
+            Filter values are sent as bind parameters and, with prepare, through a
+            server side prepared statement reused by every call of the same shape.
+
+            With partitions, the date range (or partition_range of partition_col) is
+            split into that many sub ranges read concurrently on pooled connections
+            and concatenated in range order.
+
+            With fast, rows are pulled with COPY (SELECT ...) TO STDOUT and parsed
+            straight into columns by the pandas csv parser (pyarrow engine when
+            installed) instead of building python objects row by row.
+
+            When the instance was created with a ResultCache, results are served
+            from it for identical queries until they expire or the table is written.
+
             Parameters:
-                table_name: sql table name
-                schema:     sql schema name
-                column:     columns to retrieve from database
+                table_name:        sql table name
+                schema:            sql schema name
+                columns:           columns to retrieve from database
+                conditionals:      (column, value) or (column, operator, value) filters,
+                                   see Query.OPERATORS
+                conditional_type:  AND / OR, operator joining the conditionals
+                date_col:          column restricted to the start_date, end_date range
+                order_by:          columns to order by, e.g. ["date DESC"]
+                limit:             maximum number of rows returned
+                prepare:           reuse server side prepared statements
+                partitions:        number of sub ranges to split the read into
+                partition_col:     numeric column to partition on instead of date_col
+                partition_range:   (low, high) bounds of partition_col, both inclusive
+                max_concurrency:   maximum number of partitions read at the same time
+                fast:              read through COPY TO STDOUT, dtypes follow read_sql_table
+                dtype_backend:     numpy_nullable / pyarrow backed columns for fast reads
+                use_cache:         serve and store the result through the ResultCache
                 
             Return: 
                 df:         sql table
         """
+        if self._cache is None or not use_cache:
+            return self._read(table_name, schema, columns, conditionals, conditional_type, date_col, start_date, end_date, order_by, limit, prepare, partitions, partition_col, partition_range, max_concurrency, fast, dtype_backend)
+
+        table = f"{schema}.{table_name}"
+        query = self._build_query(table_name, schema, columns, conditionals, conditional_type, date_col, start_date, end_date, order_by, limit)
+        key = ResultCache.make_key(table, query.compile() if query else columns, fast, dtype_backend, partitions, partition_col, partition_range)
+
+        df = self._cache.get(key, table)
+        if df is None:
+            # a write during the read bumps the generation and the result is dropped
+            generation = self._cache.generation(table)
+            df = self._read(table_name, schema, columns, conditionals, conditional_type, date_col, start_date, end_date, order_by, limit, prepare, partitions, partition_col, partition_range, max_concurrency, fast, dtype_backend)
+            self._cache.put(key, table, df, generation)
+        return df
+
+    def _read(self, table_name, schema, columns, conditionals, conditional_type, date_col, start_date, end_date, order_by, limit, prepare, partitions, partition_col, partition_range, max_concurrency, fast, dtype_backend):
+        if partitions and partitions > 1:
+            if limit is not None:
+                raise ValueError("limit can not be combined with partitions")
+            return self._read_partitioned(table_name, schema, columns, conditionals, conditional_type, date_col, start_date, end_date, order_by, prepare, partitions, partition_col, partition_range, max_concurrency, fast, dtype_backend)
+
+        query = self._build_query(table_name, schema, columns, conditionals, conditional_type, date_col, start_date, end_date, order_by, limit)
+
+        if fast:
+            with self._raw_connection() as connection:
+                return self._copy(connection, query or Query(table_name, schema, columns), dtype_backend)
+
+        if query is None:
+            with self._alchemy_connection() as conn:
+                try:
+                    if columns:
+                        df = pd.read_sql_table(table_name=table_name, columns=columns, schema=schema, con=conn)
+                    else:
+                        df = pd.read_sql_table(table_name=table_name, schema=schema, con=conn)
+                except Exception as e:
+                    logger.error("Unable to read table %s.%s: %s", schema, table_name, e)
+                    raise
+                else:
+                    return df
 
-        try:
-            conn = self._alchemy_engine.connect()
-
-            where_clause = ""
+        with self._raw_connection() as connection:
+            return self._execute(connection, query, prepare)
 
-            if conditionals:
+    def _read_partitioned(self, table_name, schema, columns, conditionals, conditional_type, date_col, start_date, end_date, order_by, prepare, partitions, partition_col, partition_range, max_concurrency, fast, dtype_backend):
+        """
+            Splits the read into half open [low, high) ranges of the partition
+            column, the last range is closed so its upper bound is included
+        """
+        if partition_col and partition_range:
+            low, high = partition_range
+            if isinstance(low, int) and isinstance(high, int):
+                edges = sorted(set(np.linspace(low, high, partitions + 1).round().astype(int).tolist()))
+                # a single value range still needs one closed [low, high] partition
+                if len(edges) == 1:
+                    edges = edges * 2
+            else:
+                edges = np.linspace(low, high, partitions + 1).tolist()
+            date_filter = (date_col, start_date, end_date)
+        elif date_col and start_date and end_date:
+            partition_col = date_col
+            edges = list(pd.date_range(pd.Timestamp(start_date), pd.Timestamp(end_date), periods=partitions + 1))
+            date_filter = (None, None, None)
+        else:
+            raise ValueError("partitions requires date_col, start_date and end_date or partition_col and partition_range")
 
-                if columns:
-                    columns = ",".join(columns)
-                else:
-                    columns = "*"
+        queries = []
+        for i, (low, high) in enumerate(zip(edges[:-1], edges[1:])):
+            query = self._build_query(table_name, schema, columns, conditionals, conditional_type, *date_filter, order_by) or Query(table_name, schema, columns)
+            upper = "<=" if i == len(edges) - 2 else "<"
+            query.where((partition_col, ">=", low), (partition_col, upper, high))
+            queries.append(query)
 
-                if len(conditionals) > 1 and conditional_type:
-                    conditionals = f" {conditional_type} ".join([f"{x[0]}='{x[1]}'" for x in conditionals])
-                    where_clause += f" {conditionals}"
-                else:
-                    conditionals = f"{conditionals[0][0]}='{conditionals[0][1]}'"
-                    where_clause += f" {conditionals}"
+        def read_partition(query):
+            with self._raw_connection() as connection:
+                if fast:
+                    return self._copy(connection, query, dtype_backend)
+                return self._execute(connection, query, prepare)
 
-                if date_col and start_date and end_date:
-                    where_clause += f" AND {date_col} BETWEEN '{start_date}' AND '{end_date}'"
+        with ThreadPoolExecutor(max_workers=max(1, min(len(queries), max_concurrency))) as executor:
+            frames = list(executor.map(read_partition, queries))
 
-                if where_clause:
+        # empty partitions carry no dtypes and would upcast int and bool columns
+        # to object, one is kept when every partition is empty
+        return pd.concat([frame for frame in frames if len(frame)] or frames[:1], ignore_index=True)
 
-                    print(f"SELECT {columns} FROM {schema}.{table_name} WHERE {where_clause}")
+    def read_query(self, query: Query, prepare: bool=True):
+        """
+            Retrieves the rows selected by a Query to pandas dataframe
 
-                    df = pd.read_sql(f"SELECT {columns} FROM {schema}.{table_name} WHERE {where_clause}", con=conn)
-                else:
-                    df = pd.read_sql(f"SELECT {columns} FROM {schema}.{table_name} WHERE {conditionals}", con=conn)
+            Parameters:
+                query:    <Query>
+                          statement built with py_query.Query
+                prepare:  <bool>
+                          reuse server side prepared statements
+            Return:
+                df:       query results
+        """
+        if self._cache is None:
+            with self._raw_connection() as connection:
+                return self._execute(connection, query, prepare)
+
+        key = ResultCache.make_key(*query.tables, query.compile())
+        df = self._cache.get(key, query.tables[0])
+        if df is None:
+            generation = self._cache.generation(query.tables[0])
+            with self._raw_connection() as connection:
+                df = self._execute(connection, query, prepare)
+            self._cache.put(key, query.tables[0], df, generation)
+        return df
+
+    def _execute(self, connection, query: Query, prepare: bool=True):
+        """
+            Runs query on a pooled connection and returns the rows as dataframe.
 
+            Prepared statement names are remembered in the pooled connection info,
+            which lives as long as the underlying server session, so each shape is
+            only parsed and planned once per connection. A statement planned
+            against an older table definition, e.g. before an ALTER TABLE, is
+            deallocated and prepared again once.
+        """
+        cur = connection.cursor()
+        try:
+            if prepare:
+                try:
+                    self._execute_prepared(cur, connection, query)
+                except (psycopg2.errors.FeatureNotSupported, psycopg2.errors.InvalidSqlStatementName) as e:
+                    connection.rollback()
+                    logger.info("Preparing statement of %s again: %s", query.tables[0], e)
+                    self._execute_prepared(cur, connection, query, replan=True)
             else:
-                if columns:
-                    df = pd.read_sql_table(table_name=table_name, columns=columns, schema=schema, con=conn)
-                else:
-                    df = pd.read_sql_table(table_name=table_name, schema=schema, con=conn)
+                cur.execute(*query.compile())
+            rows = cur.fetchall()
+            df = pd.DataFrame.from_records(rows, columns=[col[0] for col in cur.description], coerce_float=True)
+            connection.commit()
         except Exception as e:
-            print(e)
+            connection.rollback()
+            logger.error("Unable to execute query: %s", e)
             raise
         else:
-            conn.close()
-            return df  
+            return df
+        finally:
+            cur.close()
+
+    @staticmethod
+    def _execute_prepared(cur, connection, query: Query, replan: bool=False):
+        """
+            Executes query through its prepared statement, preparing it first when
+            the connection does not have it. At most MAX_PREPARED_STATEMENTS are
+            kept per connection, the least recently used one is deallocated first.
+        """
+        name = query.statement_name()
+        prepared = connection.info.setdefault("prepared_statements", OrderedDict())
+        if replan:
+            prepared.pop(name, None)
+            cur.execute("SELECT 1 FROM pg_prepared_statements WHERE name = %s", (name,))
+            if cur.fetchone():
+                cur.execute(f"DEALLOCATE {name}")
+
+        if name in prepared:
+            prepared.move_to_end(name)
+        else:
+            while len(prepared) >= MAX_PREPARED_STATEMENTS:
+                oldest, _ = prepared.popitem(last=False)
+                cur.execute(f"DEALLOCATE {oldest}")
+            sql, _ = query.compile(style="numeric")
+            cur.execute(f"PREPARE {name} AS {sql}")
+            prepared[name] = True
+
+        _, params = query.compile()
+        if params:
+            cur.execute(f"EXECUTE {name} (" + ",".join(["%s"] * len(params)) + ")", params)
+        else:
+            cur.execute(f"EXECUTE {name}")
+
+    def _copy(self, connection, query: Query, dtype_backend: str=None):
+        """
+            Runs query through COPY TO STDOUT in csv format and parses the output
+            with the pyarrow csv reader, or the pandas csv parser when pyarrow is
+            not installed.
+
+            Column types are looked up with a zero row execution of the query and
+            mapped onto the dtypes read_sql_table produces: integers become int64
+            (float64 with NULLs), floats float64, text stays text, booleans become
+            bool and date / timestamp columns become datetime64 in the unit pandas
+            uses for python datetimes, also when no row is returned. NULL is
+            written as \\N so empty strings survive the round trip.
+        """
+        sql, params = query.compile()
+        cur = connection.cursor()
+        try:
+            cur.execute(f"SELECT * FROM ({sql}) AS q LIMIT 0", params)
+            types = {col[0]: col[1] for col in cur.description}
+
+            buffer = tempfile.SpooledTemporaryFile(max_size=COPY_SPOOL_BYTES)
+            copy_command = cur.mogrify(f"COPY ({sql}) TO STDOUT WITH (FORMAT csv, HEADER true, NULL '\\N')", params).decode()
+            cur.copy_expert(copy_command, buffer)
+            connection.commit()
+            record_bytes("sql", "read", buffer.tell())
+        except Exception as e:
+            connection.rollback()
+            logger.error("Unable to copy query output: %s", e)
+            raise
+        finally:
+            cur.close()
+
+        with buffer:
+            buffer.seek(0)
+            if pa is not None:
+                convert_options = pa_csv.ConvertOptions(
+                    column_types={col: self._arrow_type(oid) for col, oid in types.items() if self._arrow_type(oid) is not None},
+                    null_values=["\\N"],
+                    strings_can_be_null=True,
+                    quoted_strings_can_be_null=False,
+                    true_values=["t"],
+                    false_values=["f"])
+                table = pa_csv.read_csv(buffer, convert_options=convert_options)
+                df = table.to_pandas(types_mapper=pd.ArrowDtype if dtype_backend == "pyarrow" else None)
+            else:
+                df = pd.read_csv(
+                    buffer,
+                    dtype={col: "object" for col, oid in types.items() if oid in TEXT_OIDS | BOOL_OIDS | JSON_OIDS},
+                    keep_default_na=False,
+                    na_values=["\\N"])
+                for col, oid in types.items():
+                    if oid in BOOL_OIDS:
+                        df[col] = df[col].map({"t": True, "f": False})
+
+        for col, oid in types.items():
+            if oid in JSON_OIDS:
+                # NULL documents are None as in read_sql_table, not the NaN of a text column
+                df[col] = df[col].map(json.loads, na_action="ignore").astype(object).where(df[col].notna(), None)
+            elif isinstance(df[col].dtype, pd.ArrowDtype):
+                continue
+            elif oid in DATE_OIDS:
+                unit = DAY_UNIT if oid in DAY_OIDS else TIMESTAMP_UNIT
+                df[col] = pd.to_datetime(df[col], utc=oid in TIMESTAMPTZ_OIDS).astype(f"datetime64[{unit}, UTC]" if oid in TIMESTAMPTZ_OIDS else f"datetime64[{unit}]")
+            elif oid in INT_OIDS | FLOAT_OIDS and not len(df):
+                # no row to infer from, the parser leaves the column as object
+                df[col] = df[col].astype("int64" if oid in INT_OIDS else "float64")
+
+        if dtype_backend and (dtype_backend != "pyarrow" or pa is None):
+            df = df.convert_dtypes(dtype_backend=dtype_backend)
+        return df
+
+    @staticmethod
+    def _arrow_type(oid):
+        """
+            Arrow type a COPY csv column of a postgres type oid is parsed as, None
+            to let the reader infer it
+        """
+        if oid in BOOL_OIDS:
+            return pa.bool_()
+        if oid in TEXT_OIDS | JSON_OIDS:
+            return pa.string()
+        if oid in INT_OIDS:
+            return pa.int64()
+        if oid in FLOAT_OIDS:
+            return pa.float64()
+        if oid in DATE_OIDS:
+            return pa.timestamp(DAY_UNIT if oid in DAY_OIDS else TIMESTAMP_UNIT, tz="UTC" if oid in TIMESTAMPTZ_OIDS else None)
+        return None
+
+    def read_chunks(self, table_name: str, schema: str, columns: list=None, conditionals: list=None, conditional_type: str=None, date_col: str=None, start_date: str=None, end_date: str=None, chunk_size: int=50000):
+        """
+            Streams the sql datatable as a sequence of pandas dataframes
+
+            Rows are fetched through a named server-side cursor, so only chunk_size
+            rows are held in memory at a time regardless of the table size.
+
+            Parameters:
+                table_name:  sql table name
+                schema:      sql schema name
+                columns:     columns to retrieve from database
+                chunk_size:  number of rows per yielded dataframe
+
+                remaining parameters filter rows the same way as SQL.read
+
+            Return:
+                generator of dataframes
+        """
+        query = self._build_query(table_name, schema, columns, conditionals, conditional_type, date_col, start_date, end_date)
+        if query is None:
+            query = Query(table_name, schema, columns)
+
+        with self._raw_connection() as connection:
+            cur = connection.cursor(name="read_chunks")
+            cur.itersize = chunk_size
+            try:
+                cur.execute(*query.compile())
+                while True:
+                    rows = cur.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    yield pd.DataFrame.from_records(rows, columns=[col[0] for col in cur.description], coerce_float=True)
+            except Exception as e:
+                logger.error("Unable to read chunks of %s.%s: %s", schema, table_name, e)
+                raise
+            finally:
+                cur.close()
+                connection.rollback()
+
+    def _build_query(self, table_name: str, schema: str, columns: list=None, conditionals: list=None, conditional_type: str=None, date_col: str=None, start_date: str=None, end_date: str=None, order_by: list=None, limit: int=None):
+        """
+            Builds the Query used by SQL.read and SQL.read_chunks, None when no
+            filter, ordering or limit applies and the whole table is read
+        """
+        if not (conditionals or (date_col and start_date and end_date) or order_by or limit is not None):
+            return None
+
+        query = Query(table_name, schema, columns)
+        if conditionals:
+            query.where(*conditionals, conjunction=conditional_type or "AND")
+        if date_col and start_date and end_date:
+            query.where((date_col, "between", (start_date, end_date)))
+        if order_by:
+            query.order_by(*order_by)
+        if limit is not None:
+            query.limit(limit)
+        return query
 
 
     # def update(self, df, df_name: str, schema: str, pmkey: str):
@@ -165,16 +619,43 @@ class SQL():
     #         conn.close()
 
 
-    def update(self, df, df_name: str, schema: str, pmkey: str = None):
+    def update(self, df, df_name: str, schema: str, pmkey: str = None, bulk: bool = None, chunk_rows: int = 100000):
+        """
+            Inserts dataframe rows into target table, updating rows whose primary
+            key already exists when pmkey is given
+
+            Both modes store the same values: NaN, NaT and pd.NA become NULL and
+            float columns holding only whole numbers are written as integers.
 
-        column_names = df.columns
-        records = [tuple(row) for _, row in df.iterrows()]
+            Parameters:
+                df:          <pandas dataframe>
+                             dataframe to be uploaded or updated on SQL DB
+                df_name:     <str>
+                             data table name
+                schema:      <str>
+                             sql schema name
+                pmkey:       <str>
+                             primary key column(s) used to resolve conflicts
+                bulk:        <bool>
+                             stream rows through COPY into a staging table instead of
+                             batched INSERT statements, chosen automatically for frames
+                             of BULK_UPDATE_ROWS rows or more when left as None
+                chunk_rows:  <int>
+                             number of rows serialized per COPY chunk in bulk mode
+        """
+        if bulk is None:
+            bulk = len(df) >= BULK_UPDATE_ROWS
 
-        # print(records)
+        if bulk:
+            return self._bulk_update(df, df_name, schema, pmkey, chunk_rows)
+
+        column_names = df.columns
+        # execute_batch would send float NaN as 'NaN'::float, COPY stores NULL
+        frame = self._copy_frame(df).astype(object)
+        records = list(frame.where(frame.notna(), None).itertuples(index=False, name=None))
 
         # get the sql command
         df_name = f"{schema}.{df_name}"
-        dt_sql = "{} ({})".format(df_name, ','.join(column_names))
         df_sql = "VALUES({}{})".format("%s," * (len(column_names) - 1), "%s")
         
         sql_command = f"""INSERT INTO {df_name} {df_sql}"""
@@ -183,18 +664,81 @@ class SQL():
             update_command = f"ON CONFLICT ({pmkey}) DO UPDATE SET " + ", ".join([f"{x}=excluded.{x}" for x in df.columns.tolist()])
             sql_command = " ".join([sql_command, update_command])
             
-        try:
-            connection = psycopg2.connect(self._conn_string)
+        with self._raw_connection() as connection:
             cur = connection.cursor()
-            connection.autocommit = True
-            psycopg2.extras.execute_batch(cur, sql_command, records)
-        except Exception as e:
-            connection.rollback()
-            print(e)
-            raise
-        finally:
-            cur.close()
-            connection.close()
+            try:
+                psycopg2.extras.execute_batch(cur, sql_command, records)
+                connection.commit()
+                self._invalidate(df_name)
+            except Exception as e:
+                connection.rollback()
+                logger.error("Unable to update table %s: %s", df_name, e)
+                raise
+            finally:
+                cur.close()
+
+    @staticmethod
+    def _copy_frame(df):
+        """
+            Prepares a frame for writing: float columns holding only whole
+            numbers, e.g. integer columns with missing values, are written as
+            integers so bigint targets accept them. In bulk mode missing values
+            are then written as the \\N NULL marker, so unquoted empty fields load
+            as empty strings.
+        """
+        integral = [col for col, dtype in df.dtypes.items() if dtype.kind == "f" and (df[col].dropna() % 1 == 0).all()]
+        if not integral:
+            return df
+        return df.astype({col: "Int64" for col in integral})
+
+    def _bulk_update(self, df, df_name: str, schema: str, pmkey: str, chunk_rows: int):
+        """
+            Streams the dataframe through COPY FROM STDIN into a temporary staging
+            table and merges it into the target table with a single INSERT.
+
+            Rows are serialized chunk_rows at a time so memory stays bounded by the
+            chunk size. When a key appears more than once in the frame the last
+            row wins, matching the row by row behaviour of execute_batch. NULL and
+            empty strings stay distinct, see _copy_frame.
+        """
+        for col, dtype in df.dtypes.items():
+            if pd.api.types.is_string_dtype(dtype) and (df[col] == "\\N").any():
+                raise ValueError(f"Column {col} holds the COPY NULL marker \\N as text, update it with bulk=False")
+
+        column_names = ",".join(df.columns)
+        target = f"{schema}.{df_name}"
+        staging = f"_stage_{df_name}"
+
+        merge_command = f"INSERT INTO {target} ({column_names}) SELECT {column_names} FROM "
+        if pmkey:
+            merge_command += f"(SELECT DISTINCT ON ({pmkey}) * FROM {staging} ORDER BY {pmkey}, _stage_row DESC) AS staged"
+            merge_command += f" ON CONFLICT ({pmkey}) DO UPDATE SET " + ", ".join([f"{x}=excluded.{x}" for x in df.columns.tolist()])
+        else:
+            merge_command += f"{staging} ORDER BY _stage_row"
+
+        with self._raw_connection() as connection:
+            cur = connection.cursor()
+            try:
+                cur.execute(f"CREATE TEMP TABLE {staging} (LIKE {target} INCLUDING DEFAULTS) ON COMMIT DROP")
+                cur.execute(f"ALTER TABLE {staging} ADD COLUMN _stage_row BIGSERIAL")
+
+                copy_command = f"COPY {staging} ({column_names}) FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+                for start in range(0, len(df), chunk_rows):
+                    buffer = io.StringIO()
+                    self._copy_frame(df.iloc[start:start + chunk_rows]).to_csv(buffer, header=False, index=False, na_rep="\\N")
+                    record_bytes("sql", "write", buffer.tell())
+                    buffer.seek(0)
+                    cur.copy_expert(copy_command, buffer)
+
+                cur.execute(merge_command)
+                connection.commit()
+                self._invalidate(target)
+            except Exception as e:
+                connection.rollback()
+                logger.error("Unable to bulk update table %s.%s: %s", schema, df_name, e)
+                raise
+            finally:
+                cur.close()
 
     # TODO: Need to add statement to empty table rather than drop it
     # def delete(self, table_name, params=None):
@@ -0,0 +1,182 @@
+# Incremental table sync library imports
+import os
+import json
+import logging
+import threading
+import pandas as pd
+
+from py_sql import SQL
+
+logger = logging.getLogger(__name__)
+
+class TableSync():
+
+    def __init__(self, sql: SQL, store_dir: str):
+        """
+            Keeps local parquet snapshots of SQL tables up to date by only
+            fetching rows past a stored high-water mark.
+
+            Each table is stored as <schema>.<table>.parquet next to a
+            <schema>.<table>.json state file holding the watermark. Rows deleted
+            in the database are not removed from the snapshot.
+
+            Parameters:
+                sql:        <SQL>
+                            SQL instance used to read the tables
+                store_dir:  <str>
+                            directory holding the snapshots
+        """
+        self._sql = sql
+        self._store_dir = store_dir
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        os.makedirs(store_dir, exist_ok=True)
+
+    def sync(self, table_name: str, schema: str, watermark_col: str, pmkey, columns: list=None, fast: bool=False):
+        """
+            Fetches rows changed since the last sync and merges them into the
+            local snapshot, the first sync downloads the whole table
+
+            Rows are fetched with watermark_col >= the stored mark so rows sharing
+            the last seen value are not missed, duplicates are resolved on pmkey
+            keeping the freshly fetched row. Reads bypass the SQL ResultCache, a
+            cached delta would miss rows written since.
+
+            Parameters:
+                table_name:     <str>
+                                sql table name
+                schema:         <str>
+                                sql schema name
+                watermark_col:  <str>
+                                monotonically increasing timestamp or sequence column
+                pmkey:          <str | list>
+                                primary key column(s) used to deduplicate rows
+                columns:        <list>
+                                columns to keep, all columns when None
+                fast:           <bool>
+                                read through the SQL.read COPY fast path
+            Response:
+                df:             <pandas dataframe>
+                                updated snapshot
+        """
+        keys = [pmkey] if isinstance(pmkey, str) else list(pmkey)
+        if columns:
+            columns = list(columns) + [col for col in keys + [watermark_col] if col not in columns]
+
+        with self._lock(schema, table_name):
+            state = self._read_state(table_name, schema)
+            snapshot = self.snapshot(table_name, schema)
+
+            if snapshot is None or state is None or state["watermark"] is None or state["watermark_col"] != watermark_col:
+                df = self._sql.read(table_name, schema, columns=columns, fast=fast, use_cache=False)
+            else:
+                mark = self._decode(state["watermark"])
+                delta = self._sql.read(table_name, schema, columns=columns, conditionals=[(watermark_col, ">=", mark)], fast=fast, use_cache=False)
+                df = pd.concat([snapshot, self._align(delta, snapshot)], ignore_index=True)
+
+            df = df.drop_duplicates(subset=keys, keep="last").reset_index(drop=True)
+
+            watermark = df[watermark_col].max() if len(df) else None
+            self._write(table_name, schema, df, {
+                "watermark_col": watermark_col,
+                "watermark": self._encode(watermark),
+                "rows": len(df),
+            })
+        return df
+
+    def snapshot(self, table_name: str, schema: str):
+        """
+            Retrieves the local snapshot of a table, None if it was never synced
+        """
+        path = self._path(table_name, schema, "parquet")
+        if not os.path.isfile(path):
+            return None
+        return pd.read_parquet(path)
+
+    def watermark(self, table_name: str, schema: str):
+        """
+            Retrieves the high-water mark of the last sync, None if never synced
+        """
+        state = self._read_state(table_name, schema)
+        return self._decode(state["watermark"]) if state else None
+
+    def reset(self, table_name: str, schema: str):
+        """
+            Removes the snapshot so the next sync downloads the whole table
+        """
+        with self._lock(schema, table_name):
+            for ext in ("parquet", "json"):
+                path = self._path(table_name, schema, ext)
+                if os.path.isfile(path):
+                    os.remove(path)
+
+    @staticmethod
+    def _align(delta, snapshot):
+        """
+            Casts the delta to the dtypes of the snapshot. The whole table and a
+            filtered delta are read through different SQL paths, e.g. date columns
+            come back as datetime64 from one and as datetime.date objects from the
+            other, and mixing both would leave object columns parquet rejects.
+        """
+        delta = delta.copy()
+        for col, dtype in snapshot.dtypes.items():
+            if col not in delta.columns or delta[col].dtype == dtype:
+                continue
+            try:
+                if pd.api.types.is_datetime64_any_dtype(dtype):
+                    delta[col] = pd.to_datetime(delta[col], utc=getattr(dtype, "tz", None) is not None).astype(dtype)
+                else:
+                    delta[col] = delta[col].astype(dtype)
+            except (TypeError, ValueError) as e:
+                logger.warning("Unable to cast column %s to %s: %s", col, dtype, e)
+        return delta
+
+    def _lock(self, schema, table_name):
+        with self._locks_lock:
+            return self._locks.setdefault(f"{schema}.{table_name}", threading.Lock())
+
+    def _path(self, table_name, schema, ext):
+        return os.path.join(self._store_dir, f"{schema}.{table_name}.{ext}")
+
+    def _read_state(self, table_name, schema):
+        path = self._path(table_name, schema, "json")
+        if not os.path.isfile(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def _write(self, table_name, schema, df, state):
+        # the snapshot is written before the state so a crash in between only
+        # causes the delta to be fetched again
+        # temporary names are unique per process and thread, so concurrent syncs
+        # of one store never write the same file
+        suffix = f"{os.getpid()}.{threading.get_ident()}.tmp"
+
+        path = self._path(table_name, schema, "parquet")
+        df.to_parquet(f"{path}.{suffix}", index=False)
+        os.replace(f"{path}.{suffix}", path)
+
+        path = self._path(table_name, schema, "json")
+        with open(f"{path}.{suffix}", "w") as f:
+            json.dump(state, f)
+        os.replace(f"{path}.{suffix}", path)
+
+    @staticmethod
+    def _encode(value):
+        if value is None or pd.isna(value):
+            return None
+        if isinstance(value, pd.Timestamp):
+            return {"type": "timestamp", "value": value.isoformat()}
+        if hasattr(value, "isoformat"):
+            return {"type": "timestamp", "value": pd.Timestamp(value).isoformat()}
+        if hasattr(value, "item"):
+            value = value.item()
+        return {"type": "value", "value": value}
+
+    @staticmethod
+    def _decode(value):
+        if value is None:
+            return None
+        if value["type"] == "timestamp":
+            return pd.Timestamp(value["value"]).to_pydatetime()
+        return value["value"]
@@ -0,0 +1,93 @@
+# Shared fixtures, COS runs against an in-process moto S3 server and SQL
+# against a throwaway postgres cluster when initdb / pg_ctl are installed
+import os
+import sys
+import json
+import uuid
+import shutil
+import socket
+import pytest
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+@pytest.fixture(scope="session")
+def s3_endpoint():
+    moto_server = pytest.importorskip("moto.server")
+    port = free_port()
+    server = moto_server.ThreadedMotoServer(ip_address="127.0.0.1", port=port, verbose=False)
+    server.start()
+    yield f"http://127.0.0.1:{port}"
+    server.stop()
+
+@pytest.fixture
+def cos(s3_endpoint, monkeypatch):
+    pytest.importorskip("ibm_boto3")
+    import utils
+
+    vcap = {"cloud-object-storage": [{"credentials": {
+        "cos_hmac_keys": {"access_key_id": "test", "secret_access_key": "test-secret"}}}]}
+    monkeypatch.setenv("VCAP_SERVICES", json.dumps(vcap))
+    monkeypatch.setenv("COS_ENDPOINT", s3_endpoint)
+    utils.load_vcap(reload=True)
+
+    from py_cos import COS
+    cos = COS(max_workers=4)
+    cos.bucket = f"test-{uuid.uuid4().hex[:12]}"
+    cos._cos_cli.create_bucket(Bucket=cos.bucket)
+    yield cos
+    utils._vcap = None
+
+@pytest.fixture(scope="session")
+def postgres(tmp_path_factory):
+    # binaries are looked up in PG_BIN or on PATH, initdb refuses to run as root
+    binaries = [os.path.join(os.getenv("PG_BIN"), name) if os.getenv("PG_BIN") else shutil.which(name) for name in ("initdb", "pg_ctl")]
+    if not all(binary and os.path.isfile(binary) for binary in binaries) or os.geteuid() == 0:
+        pytest.skip("postgres is not available")
+    initdb, pg_ctl = binaries
+
+    root = str(tmp_path_factory.mktemp("postgres"))
+    data = os.path.join(root, "data")
+    port = free_port()
+    subprocess.run([initdb, "-D", data, "-U", "test", "-A", "trust", "--no-sync"], check=True, capture_output=True)
+    options = f"-p {port} -k {root} -c listen_addresses=127.0.0.1 -c fsync=off"
+    subprocess.run([pg_ctl, "-D", data, "-o", options, "-l", os.path.join(root, "postgres.log"), "-w", "start"], check=True, capture_output=True)
+    yield {"hostname": "127.0.0.1", "port": port}
+    subprocess.run([pg_ctl, "-D", data, "-m", "fast", "-w", "stop"], capture_output=True)
+
+@pytest.fixture
+def sql(postgres, monkeypatch):
+    pytest.importorskip("psycopg2")
+    pytest.importorskip("sqlalchemy")
+    import utils
+
+    composed = f"postgresql+psycopg2://test@{postgres['hostname']}:{postgres['port']}/postgres"
+    vcap = {"databases-for-postgresql": [{"credentials": {"connection": {"postgres": {
+        "hosts": [postgres],
+        "authentication": {"username": "test", "password": ""},
+        "database": "postgres",
+        "composed": [composed]}}}}]}
+    monkeypatch.setenv("VCAP_SERVICES", json.dumps(vcap))
+    utils.load_vcap(reload=True)
+
+    from py_sql import SQL
+    sql = SQL()
+    sql.schema = f"test_{uuid.uuid4().hex[:12]}"
+    sql.execute_sql = lambda command: _execute_sql(sql, command)
+    sql.execute_sql(f"CREATE SCHEMA {sql.schema}")
+    yield sql
+    sql.execute_sql(f"DROP SCHEMA {sql.schema} CASCADE")
+    sql.close()
+    utils._vcap = None
+
+def _execute_sql(sql, command):
+    with sql._raw_connection() as connection:
+        cur = connection.cursor()
+        cur.execute(command)
+        connection.commit()
+        cur.close()
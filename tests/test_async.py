@@ -0,0 +1,62 @@
+import asyncio
+import threading
+import pytest
+
+pd = pytest.importorskip("pandas")
+pytest.importorskip("pymongo")
+
+from py_async import AsyncCOS
+
+def test_lazy_cos_results_are_pulled_off_the_event_loop(cos, monkeypatch):
+    cos.create_text_file(cos.bucket, "chunks.csv", pd.DataFrame({"id": range(10)}).to_csv(index=False))
+    loop_threads = set()
+    iter_bucket_contents = cos.iter_bucket_contents
+
+    def record_thread(*args, **kwargs):
+        for entry in iter_bucket_contents(*args, **kwargs):
+            loop_threads.add(threading.get_ident())
+            yield entry
+
+    monkeypatch.setattr(cos, "iter_bucket_contents", record_thread)
+
+    async def run():
+        async with AsyncCOS(cos, max_concurrency=2) as acos:
+            chunks = [chunk async for chunk in await acos.get_item(cos.bucket, "chunks.csv", chunksize=4)]
+            keys = [entry async for entry in await acos.iter_bucket_contents(cos.bucket, metadata=False)]
+        return chunks, keys, threading.get_ident()
+
+    chunks, keys, loop_thread = asyncio.run(run())
+
+    assert [len(chunk) for chunk in chunks] == [4, 4, 2]
+    assert keys == ["chunks.csv"]
+    assert loop_threads and loop_thread not in loop_threads
+
+def test_async_update_stores_missing_values_as_null(sql):
+    pytest.importorskip("asyncpg")
+    from py_async import AsyncSQL
+
+    sql.create(f"{sql.schema}.values", ["id BIGINT", "n BIGINT", "f DOUBLE PRECISION", "s TEXT", "at TIMESTAMP", "id"])
+    df = pd.DataFrame({
+        "id": [1, 2],
+        "n": [5, None],
+        "f": [1.5, None],
+        "s": ["x", None],
+        "at": pd.to_datetime(["2024-01-01", None]),
+    })
+
+    asql = AsyncSQL()
+    # asyncpg takes the plain postgresql scheme of the composed url
+    asql._dsn = asql._dsn.replace("+psycopg2", "")
+
+    async def run():
+        async with asql:
+            await asql.update(df, "values", sql.schema, pmkey="id")
+
+    asyncio.run(run())
+
+    with sql._raw_connection() as connection:
+        cur = connection.cursor()
+        cur.execute(f"SELECT n, f, s, at FROM {sql.schema}.values ORDER BY id")
+        rows = cur.fetchall()
+    assert rows[0][:3] == (5, 1.5, "x")
+    assert rows[1] == (None, None, None, None)
@@ -0,0 +1,103 @@
+import os
+import pytest
+
+pd = pytest.importorskip("pandas")
+
+import py_cache
+from py_cache import ResultCache
+
+class Clock():
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(py_cache.time, "time", clock)
+    return clock
+
+def frame(rows):
+    return pd.DataFrame({"id": range(rows)})
+
+def test_entries_expire_after_ttl(clock):
+    cache = ResultCache(ttl=10)
+    cache.put("k", "public.t", frame(3))
+
+    clock.now += 9
+    assert cache.get("k", "public.t").equals(frame(3))
+    clock.now += 2
+    assert cache.get("k", "public.t") is None
+    assert cache.stats()["entries"] == 0
+
+def test_least_recently_used_entries_are_evicted_by_bytes():
+    size = int(frame(100).memory_usage(deep=True).sum())
+    cache = ResultCache(max_bytes=size * 2)
+    cache.put("a", "public.t", frame(100))
+    cache.put("b", "public.t", frame(100))
+    cache.get("a", "public.t")
+    cache.put("c", "public.t", frame(100))
+
+    assert cache.get("b", "public.t") is None
+    assert cache.get("a", "public.t") is not None
+    assert cache.get("c", "public.t") is not None
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["bytes"] == size * 2
+
+def test_cached_frames_are_copies():
+    cache = ResultCache()
+    df = frame(3)
+    cache.put("k", "public.t", df)
+    df.loc[0, "id"] = 99
+    served = cache.get("k", "public.t")
+    served.loc[1, "id"] = 99
+
+    assert cache.get("k", "public.t").equals(frame(3))
+
+def test_invalidate_drops_only_the_written_table():
+    cache = ResultCache()
+    cache.put("a", "public.t", frame(1))
+    cache.put("b", "public.other", frame(1))
+    cache.invalidate("PUBLIC.T")
+
+    assert cache.get("a", "public.t") is None
+    assert cache.get("b", "public.other") is not None
+
+def test_result_read_before_a_write_is_not_stored():
+    cache = ResultCache()
+    generation = cache.generation("public.t")
+    cache.invalidate("public.t")
+    cache.put("k", "public.t", frame(1), generation)
+
+    assert cache.get("k", "public.t") is None
+    cache.put("k", "public.t", frame(1), cache.generation("public.t"))
+    assert cache.get("k", "public.t") is not None
+
+def test_disk_tier(tmp_path, clock):
+    pytest.importorskip("pyarrow")
+    cache = ResultCache(ttl=10, disk_dir=str(tmp_path))
+    cache.put("a", "public.t", frame(3))
+    cache.put("b", "public.other", frame(2))
+
+    restarted = ResultCache(ttl=10, disk_dir=str(tmp_path))
+    assert restarted.get("a", "public.t").equals(frame(3))
+    assert restarted.stats()["disk_hits"] == 1
+
+    restarted.invalidate("public.t")
+    assert ResultCache(ttl=10, disk_dir=str(tmp_path)).get("a", "public.t") is None
+
+    stale = ResultCache(ttl=10, disk_dir=str(tmp_path))
+    generation = stale.generation("public.other")
+    stale.invalidate("public.other")
+    stale.put("b", "public.other", frame(2), generation)
+    assert ResultCache(ttl=10, disk_dir=str(tmp_path)).get("b", "public.other") is None
+
+    cache.put("c", "public.t", frame(1))
+    # disk entries expire by the age of their file
+    path = cache._disk_path("c", "public.t")
+    os.utime(path, (clock.now - 11, clock.now - 11))
+    assert ResultCache(ttl=10, disk_dir=str(tmp_path)).get("c", "public.t") is None
+    assert not os.path.exists(path)
@@ -0,0 +1,86 @@
+import io
+import gzip
+import pytest
+
+pd = pytest.importorskip("pandas")
+
+from py_metrics import REGISTRY
+
+@pytest.fixture
+def df():
+    return pd.DataFrame({"id": range(1000), "label": [f"row {i}" for i in range(1000)]})
+
+def written_bytes():
+    return REGISTRY.snapshot()["counters"].get(("bytes_total", (("component", "cos"), ("direction", "write"))), 0)
+
+def test_upload_file_through_instrumented_cos(cos, df):
+    before = written_bytes()
+    body = df.to_csv(index=False).encode()
+    cos.upload_file_cos(cos.bucket, "file.csv", io.BytesIO(body))
+
+    assert cos.get_item(cos.bucket, "file.csv").equals(df)
+    assert written_bytes() - before == len(body)
+
+def test_upload_many_through_instrumented_cos(cos):
+    results = cos.upload_many(cos.bucket, [(f"many/{i}", b"x" * i) for i in range(1, 6)])
+
+    assert [result.error for result in results] == [None] * 5
+    assert len(cos.get_bucket_contents(cos.bucket, "many/")) == 5
+
+def test_write_dataframe_through_instrumented_cos(cos, df):
+    cos.write_dataframe(df, cos.bucket, "frame.parquet")
+
+    assert cos.read_dataframe(cos.bucket, "frame.parquet").equals(df)
+
+def test_upload_many_and_get_items_agree_on_codec(cos, df):
+    body = df.to_csv(index=False).encode()
+    results = cos.upload_many(cos.bucket, {"many.csv.gz": body, "many.csv.zst": body})
+
+    assert [result.error for result in results] == [None, None]
+    assert [result.result.equals(df) for result in cos.get_items(cos.bucket, ["many.csv.gz", "many.csv.zst"])] == [True, True]
+
+def test_upload_file_does_not_compress_twice(cos, df):
+    body = df.to_csv(index=False).encode()
+    cos.upload_file_cos(cos.bucket, "file.csv.gz", io.BytesIO(gzip.compress(body)))
+
+    stored = cos._cos_cli.get_object(Bucket=cos.bucket, Key="file.csv.gz")["Body"].read()
+    assert gzip.decompress(stored) == body
+    assert cos.get_item(cos.bucket, "file.csv.gz").equals(df)
+
+def test_byte_range_of_compressed_item_reads_it_whole(cos, df):
+    cos.create_text_file(cos.bucket, "range.csv.gz", df.to_csv(index=False))
+
+    assert cos.get_item(cos.bucket, "range.csv.gz", byte_range=(0, 100)).equals(df)
+    assert cos.get_item(cos.bucket, "range.csv.gz", byte_range=(100, 200)).equals(df)
+
+def test_compressed_item_without_suffix(cos, df):
+    cos.create_text_file(cos.bucket, "metadata.csv", df.to_csv(index=False), compression="zstd")
+    cos._cos_cli.put_object(Bucket=cos.bucket, Key="plain.csv", Body=gzip.compress(df.to_csv(index=False).encode()))
+
+    assert cos.get_item(cos.bucket, "metadata.csv").equals(df)
+    assert cos.get_item(cos.bucket, "plain.csv").equals(df)
+    assert cos.get_item_parallel(cos.bucket, "plain.csv", part_size=1024).equals(df)
+
+def test_write_dataframe_raises_upload_errors(cos, df):
+    with pytest.raises(Exception):
+        cos.write_dataframe(df, f"{cos.bucket}-missing", "frame.parquet")
+
+def test_delete_many_takes_keys_or_an_explicit_prefix(cos):
+    cos.upload_many(cos.bucket, {"report.csv": b"a", "report.csv.bak": b"b", "logs/1": b"c", "logs/2": b"d"})
+
+    with pytest.raises(TypeError):
+        cos.delete_many(cos.bucket, "report.csv")
+    assert cos.delete_many(cos.bucket, ["report.csv"]) == []
+    assert cos.delete_many(cos.bucket, prefix="logs/") == []
+    assert cos.get_bucket_contents(cos.bucket) == ["report.csv.bak"]
+
+@pytest.mark.parametrize("item_name, format", [("frame.csv", "csv"), ("frame.csv.gz", "csv"), ("frame.parquet", "parquet")])
+def test_upload_dataframe_round_trip(cos, df, item_name, format):
+    pytest.importorskip("pyarrow")
+    cos.upload_dataframe(df, cos.bucket, item_name, format=format, chunk_rows=300)
+
+    if format == "parquet":
+        result = cos.read_dataframe(cos.bucket, item_name)
+    else:
+        result = cos.get_item(cos.bucket, item_name)
+    pd.testing.assert_frame_equal(result, df, check_dtype=False)
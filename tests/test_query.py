@@ -0,0 +1,38 @@
+import pytest
+
+from py_query import Query
+
+def test_compile_without_conditions():
+    assert Query("prices", "public").compile() == ("SELECT * FROM public.prices", [])
+
+def test_compile_binds_every_value():
+    query = Query("prices", "public", ["id", "price"]).where(("id", 1), ("price", ">", 2.5)).order_by("id DESC").limit(10)
+
+    assert query.compile() == ("SELECT id,price FROM public.prices WHERE (id = %s AND price > %s) ORDER BY id DESC LIMIT %s", [1, 2.5, 10])
+    assert query.compile(style="numeric")[0] == "SELECT id,price FROM public.prices WHERE (id = $1 AND price > $2) ORDER BY id DESC LIMIT $3"
+
+def test_condition_groups_are_combined_with_and():
+    query = Query("prices", "public").where(("a", 1), ("b", 2), conjunction="or").where(("c", "between", (3, 4)))
+
+    assert query.compile(style="numeric") == ("SELECT * FROM public.prices WHERE (a = $1 OR b = $2) AND (c BETWEEN $3 AND $4)", [1, 2, 3, 4])
+
+def test_list_and_null_operators():
+    query = Query("prices", "public").where(("a", "in", (1, 2)), ("b", "not in", [3]), ("c", None), ("d", "!=", None))
+
+    assert query.compile() == (
+        "SELECT * FROM public.prices WHERE (a = ANY(%s) AND b <> ALL(%s) AND c IS NULL AND d IS NOT NULL)", [[1, 2], [3]])
+
+def test_unsupported_operator_and_conjunction():
+    with pytest.raises(ValueError):
+        Query("prices", "public").where(("a", "~", 1))
+    with pytest.raises(ValueError):
+        Query("prices", "public").where(("a", 1), conjunction="XOR")
+
+def test_statement_name_depends_on_shape_only():
+    first = Query("prices", "public").where(("id", 1)).limit(5)
+    second = Query("prices", "public").where(("id", 2)).limit(50)
+    other = Query("prices", "public").where(("id", ">", 1)).limit(5)
+
+    assert first.statement_name() == second.statement_name()
+    assert first.statement_name() != other.statement_name()
+    assert first.statement_name().startswith("ro_")
@@ -0,0 +1,175 @@
+import io
+import pytest
+import contextlib
+
+pd = pytest.importorskip("pandas")
+psycopg2 = pytest.importorskip("psycopg2")
+
+import py_sql
+from py_sql import SQL
+from py_query import Query
+
+class FakeCursor():
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.description = [("id",)]
+
+    def execute(self, sql, params=None):
+        self.connection.statements.append(sql)
+        if sql.startswith("EXECUTE") and self.connection.stale:
+            self.connection.stale = False
+            raise psycopg2.errors.FeatureNotSupported("cached plan must not change result type")
+
+    def fetchone(self):
+        return (1,)
+
+    def fetchall(self):
+        return [(1,)]
+
+    def close(self):
+        pass
+
+class FakeConnection():
+
+    def __init__(self):
+        self.info = {}
+        self.statements = []
+        self.stale = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+def test_stale_prepared_statement_is_prepared_again():
+    sql, connection = SQL.__new__(SQL), FakeConnection()
+    query = Query("prices", "public").where(("id", 1))
+    name = query.statement_name()
+
+    sql._execute(connection, query)
+    connection.stale = True
+    df = sql._execute(connection, query)
+
+    assert df["id"].tolist() == [1]
+    assert [" ".join(statement.split()[:2]) for statement in connection.statements] == [
+        f"PREPARE {name}", f"EXECUTE {name}",
+        f"EXECUTE {name}",
+        "SELECT 1", f"DEALLOCATE {name}", f"PREPARE {name}", f"EXECUTE {name}"]
+
+def test_prepared_statements_per_connection_are_capped(monkeypatch):
+    monkeypatch.setattr(py_sql, "MAX_PREPARED_STATEMENTS", 2)
+    sql, connection = SQL.__new__(SQL), FakeConnection()
+    queries = [Query("prices", "public").where((column, 1)) for column in ("a", "b", "a", "c")]
+
+    for query in queries:
+        sql._execute(connection, query)
+
+    assert list(connection.info["prepared_statements"]) == [queries[0].statement_name(), queries[3].statement_name()]
+    assert connection.statements.count(f"DEALLOCATE {queries[1].statement_name()}") == 1
+
+def test_partitioned_read_of_a_single_value_range(monkeypatch):
+    sql, connection = SQL.__new__(SQL), FakeConnection()
+    sql._cache = None
+    monkeypatch.setattr(sql, "_raw_connection", contextlib.contextmanager(lambda: (yield connection)), raising=False)
+
+    df = sql.read("prices", "public", partitions=4, partition_col="id", partition_range=(7, 7), prepare=False)
+
+    assert df["id"].tolist() == [1]
+    assert connection.statements == ["SELECT * FROM public.prices WHERE (id >= %s AND id <= %s)"]
+
+@pytest.mark.parametrize("fast", [False, True])
+def test_partitioned_read_keeps_dtypes_with_an_empty_partition(sql, fast):
+    table = f"{sql.schema}.parts"
+    sql.create(table, ["id BIGINT", "n BOOLEAN", "at TIMESTAMPTZ", "id"])
+    sql.execute_sql(f"INSERT INTO {table} VALUES (1, true, '2024-01-01 10:00+00'), (2, false, '2024-01-02 10:00+00'), (99, true, '2024-01-03 10:00+00')")
+
+    whole = sql.read("parts", sql.schema, order_by=["id"], fast=fast)
+    parts = sql.read("parts", sql.schema, partitions=3, partition_col="id", partition_range=(1, 99), fast=fast)
+
+    assert parts["id"].tolist() == [1, 2, 99]
+    assert parts.dtypes.to_dict() == whole.dtypes.to_dict()
+
+@pytest.fixture
+def typed_table(sql):
+    sql.create(f"{sql.schema}.typed", [
+        "id BIGINT", "i INTEGER", "f DOUBLE PRECISION", "num NUMERIC", "s TEXT", "b BOOLEAN",
+        "d DATE", "ts TIMESTAMP", "tz TIMESTAMPTZ", "j JSONB", "id"])
+    return "typed"
+
+def insert_typed_rows(sql):
+    sql.execute_sql(f"""INSERT INTO {sql.schema}.typed VALUES
+        (1, 2, 1.5, 2.25, 'x', true, '2024-01-01', '2024-01-01 10:00', '2024-01-01 10:00+00', '{{"a": 1}}'),
+        (2, NULL, NULL, NULL, '', false, NULL, NULL, NULL, NULL)""")
+
+def test_fast_read_matches_read_dtypes(sql, typed_table):
+    pytest.importorskip("pyarrow")
+    insert_typed_rows(sql)
+
+    df = sql.read(typed_table, sql.schema)
+    fast = sql.read(typed_table, sql.schema, fast=True)
+
+    assert fast.dtypes.to_dict() == df.dtypes.to_dict()
+    pd.testing.assert_frame_equal(fast.sort_values("id", ignore_index=True), df.sort_values("id", ignore_index=True))
+
+def test_fast_read_of_no_rows_keeps_column_dtypes(sql, typed_table):
+    df = sql.read(typed_table, sql.schema, fast=True)
+
+    assert df.empty
+    assert df.dtypes[["id", "i", "f", "b"]].astype(str).tolist() == ["int64", "int64", "float64", "bool"]
+    assert all(pd.api.types.is_datetime64_any_dtype(df[col]) for col in ("d", "ts", "tz"))
+    assert str(df["tz"].dtype.tz) == "UTC"
+
+def test_fast_read_keeps_arrow_dtypes(sql, typed_table):
+    pytest.importorskip("pyarrow")
+    insert_typed_rows(sql)
+
+    df = sql.read(typed_table, sql.schema, fast=True, dtype_backend="pyarrow")
+
+    assert all(isinstance(df[col].dtype, pd.ArrowDtype) for col in df.columns if col != "j")
+    assert str(df["ts"].dtype.pyarrow_dtype).startswith("timestamp")
+
+def test_copy_frame_writes_whole_floats_as_integers():
+    df = pd.DataFrame({"n": [1.0, None], "f": [1.5, None], "s": ["", None]})
+    buffer = io.StringIO()
+    SQL._copy_frame(df).to_csv(buffer, header=False, index=False, na_rep="\\N")
+
+    assert buffer.getvalue().splitlines() == ["1,1.5,", "\\N,\\N,\\N"]
+
+@pytest.mark.parametrize("bulk", [False, True])
+def test_update_stores_null_empty_strings_and_integers(sql, bulk):
+    sql.create(f"{sql.schema}.updates", ["id BIGINT", "n BIGINT", "f DOUBLE PRECISION", "s TEXT", "id"])
+    df = pd.DataFrame({
+        "id": [1, 2, 3, 1],
+        "n": [10, None, 30, 11],
+        "f": [1.5, None, float("nan"), 2.5],
+        "s": ["a", "", None, "b"],
+    })
+
+    sql.update(df.iloc[:3], "updates", sql.schema, pmkey="id", bulk=bulk)
+    sql.update(df.iloc[3:], "updates", sql.schema, pmkey="id", bulk=bulk)
+
+    with sql._raw_connection() as connection:
+        cur = connection.cursor()
+        cur.execute(f"SELECT id, n, f, s FROM {sql.schema}.updates ORDER BY id")
+        assert cur.fetchall() == [(1, 11, 2.5, "b"), (2, None, None, ""), (3, 30, None, None)]
+
+def test_bulk_update_keeps_the_last_duplicate_key(sql):
+    sql.create(f"{sql.schema}.duplicates", ["id BIGINT", "v TEXT", "id"])
+    df = pd.DataFrame({"id": [1, 2, 1, 1], "v": ["first", "x", "second", "last"]})
+
+    sql.update(df, "duplicates", sql.schema, pmkey="id", bulk=True)
+
+    assert sql.read("duplicates", sql.schema, order_by=["id"])["v"].tolist() == ["last", "x"]
+
+def test_bulk_update_refuses_the_null_marker_as_text(sql):
+    sql.create(f"{sql.schema}.marker", ["id BIGINT", "v TEXT", "id"])
+
+    with pytest.raises(ValueError):
+        sql.update(pd.DataFrame({"id": [1], "v": ["\\N"]}), "marker", sql.schema, bulk=True)
+    sql.update(pd.DataFrame({"id": [1], "v": ["\\N"]}), "marker", sql.schema, bulk=False)
+    assert sql.read("marker", sql.schema)["v"].tolist() == ["\\N"]
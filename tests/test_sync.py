@@ -0,0 +1,51 @@
+import os
+import pytest
+
+pd = pytest.importorskip("pandas")
+pytest.importorskip("pyarrow")
+pytest.importorskip("psycopg2")
+
+from py_sync import TableSync
+
+class FakeSQL():
+
+    def __init__(self, *frames):
+        self.frames = list(frames)
+        self.calls = []
+
+    def read(self, table_name, schema, **kwargs):
+        self.calls.append(kwargs)
+        return self.frames.pop(0)
+
+def test_sync_bypasses_the_result_cache(tmp_path):
+    sql = FakeSQL(
+        pd.DataFrame({"id": [1, 2], "ts": [1, 2]}),
+        pd.DataFrame({"id": [2, 3], "ts": [2, 3]}))
+    sync = TableSync(sql, str(tmp_path))
+
+    sync.sync("prices", "public", "ts", "id")
+    df = sync.sync("prices", "public", "ts", "id")
+
+    assert df.sort_values("id")["id"].tolist() == [1, 2, 3]
+    assert sync.watermark("prices", "public") == 3
+    assert [call["use_cache"] for call in sql.calls] == [False, False]
+    assert sql.calls[1]["conditionals"] == [("ts", ">=", 2)]
+    assert sorted(os.listdir(tmp_path)) == ["public.prices.json", "public.prices.parquet"]
+
+def test_sync_of_date_and_timestamp_columns(sql, tmp_path):
+    table = f"{sql.schema}.events"
+    sql.create(table, ["id BIGINT", "day DATE", "at TIMESTAMP", "at_tz TIMESTAMPTZ", "updated BIGINT", "id"])
+    sql.execute_sql(f"INSERT INTO {table} VALUES (1, '2024-01-01', '2024-01-01 10:00', '2024-01-01 10:00+00', 1), (2, '2024-01-02', '2024-01-02 10:00', '2024-01-02 10:00+00', 2)")
+    sync = TableSync(sql, str(tmp_path))
+
+    sync.sync("events", sql.schema, "updated", "id")
+    sql.execute_sql(f"INSERT INTO {table} VALUES (3, '2024-01-03', '2024-01-03 10:00', '2024-01-03 10:00+00', 3)")
+    second = sync.sync("events", sql.schema, "updated", "id")
+    third = sync.sync("events", sql.schema, "updated", "id")
+
+    assert second["id"].tolist() == [1, 2, 3]
+    assert all(pd.api.types.is_datetime64_any_dtype(second[col]) for col in ("day", "at", "at_tz"))
+    assert third.dtypes.to_dict() == second.dtypes.to_dict()
+    assert second["day"].tolist() == list(pd.to_datetime(["2024-01-01", "2024-01-02", "2024-01-03"]))
+    assert third["id"].tolist() == [1, 2, 3]
+    assert sync.watermark("events", sql.schema) == 3
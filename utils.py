@@ -1,2 +1,44 @@
+import os
+import json
+import threading
+
 class MissingCreds(Exception):
-    pass
\ No newline at end of file
+    pass
+
+_vcap = None
+_vcap_lock = threading.Lock()
+
+def load_vcap(reload: bool=False):
+    """
+        Retrieves VCAP_SERVICES from the OS environment or from a local
+        vcap_services.json file, parsed once per process
+
+        Parameters:
+            reload:  <bool>
+                     parse the credentials again, e.g. after they were rotated
+    """
+    global _vcap
+
+    with _vcap_lock:
+        if _vcap is None or reload:
+            if 'VCAP_SERVICES' in os.environ:
+                _vcap = json.loads(os.getenv('VCAP_SERVICES'))
+            elif os.path.isfile('vcap_services.json'):
+                with open('vcap_services.json') as f:
+                    _vcap = json.load(f)
+            else:
+                raise MissingCreds("VCAP_SERVICES Not found in OS Environment!")
+        return _vcap
+
+def get_service_credentials(service):
+    """
+        Retrieves the credentials of the first instance of a VCAP service
+
+        Parameters:
+            service:  <str>
+                      VCAP service name, e.g. databases-for-postgresql
+    """
+    vcap = load_vcap()
+    if service not in vcap:
+        raise MissingCreds(f"{service} creds not found in OS Environment!")
+    return vcap[service][0]["credentials"]